@@ -0,0 +1,177 @@
+"""
+Benchmark of samplers on SyntheticEnv.
+Steps/sec, latency of sample() and memory are reported for each sampler and number of workers.
+
+Example:
+    python benchmark_samplers.py --samplers process,thread,ray,distributed --num_workers 1,2,4 --step_cost 1e-4
+
+DistributedEpiSampler is measured with one node on this machine,
+using a redis-server started by this script (`redis-server` has to be in PATH).
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import psutil
+import torch
+
+from machina.envs import SyntheticEnv
+from machina.pols import GaussianPol
+from machina.pols.random_pol import RandomPol
+from machina.samplers import EpiSampler, DistributedEpiSampler
+from machina import logger
+from machina.utils import make_redis
+
+from simple_net import PolNet
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--samplers', type=str, default='process,thread',
+                    help='Comma separated samplers from process, thread, ray and distributed.')
+parser.add_argument('--num_workers', type=str, default='1,2,4',
+                    help='Comma separated numbers of workers.')
+parser.add_argument('--ob_dim', type=int, default=8,
+                    help='Dimension of observations.')
+parser.add_argument('--ac_dim', type=int, default=2,
+                    help='Dimension of actions.')
+parser.add_argument('--epi_length', type=int, default=100,
+                    help='Number of steps of an episode.')
+parser.add_argument('--step_cost', type=float, default=0.,
+                    help='Seconds spent in a step of env.')
+parser.add_argument('--release_gil', action='store_true', default=False,
+                    help='If True, step_cost is spent without holding the GIL.')
+parser.add_argument('--pol', type=str, choices=['random', 'mlp'], default='mlp',
+                    help='random is RandomPol, and mlp is GaussianPol with PolNet.')
+parser.add_argument('--max_steps', type=int, default=10000,
+                    help='Number of steps of a sampling.')
+parser.add_argument('--num_samples', type=int, default=5,
+                    help='Number of measured samplings. A sampling for warm up is added.')
+parser.add_argument('--redis_port', type=str, default='6399',
+                    help='Port of redis-server for distributed.')
+parser.add_argument('--seed', type=int, default=256)
+parser.add_argument('--output', type=str, default='',
+                    help='If specified, results are written to this csv file.')
+args = parser.parse_args()
+
+np.random.seed(args.seed)
+torch.manual_seed(args.seed)
+
+env = SyntheticEnv(args.ob_dim, args.ac_dim, args.epi_length,
+                   args.step_cost, args.release_gil, args.seed)
+if args.pol == 'random':
+    pol = RandomPol(env.observation_space, env.action_space)
+else:
+    pol = GaussianPol(env.observation_space, env.action_space,
+                      PolNet(env.observation_space, env.action_space))
+
+
+def rss_mb():
+    """
+    Resident memory of this process and its descendants in MB.
+    """
+    processes = [psutil.Process()] + \
+        psutil.Process().children(recursive=True)
+    rss = 0
+    for p in processes:
+        try:
+            rss += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss / 1024 ** 2
+
+
+def kill_children():
+    for child in psutil.Process().children(recursive=True):
+        try:
+            child.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    psutil.wait_procs(psutil.Process().children(recursive=True), timeout=10)
+
+
+def measure_sampler(sample):
+    """
+    Parameters
+    ----------
+    sample : function
+        Sampling max_steps steps, which returns epis.
+
+    Returns
+    -------
+    result : dict
+    """
+    sample()
+    latencies = []
+    num_steps = 0
+    for _ in range(args.num_samples):
+        start = time.perf_counter()
+        epis = sample()
+        latencies.append(time.perf_counter() - start)
+        num_steps += sum([len(epi['rews']) for epi in epis])
+    return dict(steps_per_sec=num_steps / sum(latencies),
+                latency_mean=np.mean(latencies),
+                latency_max=np.max(latencies),
+                rss_mb=rss_mb())
+
+
+def bench_epi_sampler(num_workers, backend):
+    sampler = EpiSampler(env, pol, num_parallel=num_workers,
+                         seed=args.seed, backend=backend)
+    result = measure_sampler(lambda: sampler.sample(
+        pol, max_steps=args.max_steps))
+    sampler.close()
+    return result
+
+
+def bench_ray_sampler(num_workers):
+    import ray
+    from machina.samplers.raysampler import EpiSampler as RaySampler
+    ray.init(num_cpus=num_workers)
+    sampler = RaySampler(env, pol, num_parallel=num_workers, seed=args.seed)
+    result = measure_sampler(lambda: sampler.sample(
+        max_steps=args.max_steps))
+    ray.shutdown()
+    return result
+
+
+def bench_distributed_sampler(num_workers):
+    if shutil.which('redis-server') is None:
+        raise RuntimeError('redis-server is not found.')
+    subprocess.Popen(['redis-server', '--port', args.redis_port, '--save', ''],
+                     stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    # The node imports simple_net, so it is started in this directory.
+    subprocess.Popen(['python', '-m', 'machina.samplers.distributed_epi_sampler', '--world_size', '1', '--rank', '0',
+                      '--redis_port', args.redis_port], cwd=os.path.dirname(os.path.abspath(__file__)))
+    make_redis('localhost', args.redis_port)
+    sampler = DistributedEpiSampler(
+        1, -1, env, pol, num_parallel=num_workers, seed=args.seed)
+    result = measure_sampler(lambda: sampler.sample(
+        pol, max_steps=args.max_steps))
+    kill_children()
+    return result
+
+
+benches = dict(process=lambda n: bench_epi_sampler(n, 'process'),
+               thread=lambda n: bench_epi_sampler(n, 'thread'),
+               ray=bench_ray_sampler,
+               distributed=bench_distributed_sampler)
+
+results = []
+for name in args.samplers.split(','):
+    for num_workers in [int(n) for n in args.num_workers.split(',')]:
+        result = benches[name](num_workers)
+        result = dict(sampler=name, num_workers=num_workers, **result)
+        logger.log('{sampler} num_workers={num_workers}: {steps_per_sec:.1f} steps/sec, '
+                   'latency mean={latency_mean:.3f}s max={latency_max:.3f}s, rss={rss_mb:.1f}MB'.format(**result))
+        results.append(result)
+
+if len(args.output) != 0:
+    with open(args.output, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
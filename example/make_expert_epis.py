@@ -33,6 +33,10 @@ parser.add_argument('--epis_dir', type=str, default='../data/expert_epis',
                     help='Directory path to store file of expert trajectory.')
 parser.add_argument('--epis_fname', type=str, default='',
                     help='File name of expert trajectory.')
+parser.add_argument('--record_dir', type=str, default='',
+                    help='If specified, epis are appended to sharded files in this directory instead of a pickle file.')
+parser.add_argument('--epis_per_sample', type=int, default=100,
+                    help='Number of episodes sampled at once with record_dir.')
 parser.add_argument('--env_name', type=str,
                     default='Pendulum-v0', help='Name of environment.')
 parser.add_argument('--c2d', action='store_true',
@@ -108,20 +112,31 @@ else:
         raise ValueError('Only Box, Discrete, and MultiDiscrete are supported')
 
 
-sampler = EpiSampler(env, pol, num_parallel=args.num_parallel,  seed=args.seed)
+sampler = EpiSampler(env, pol, num_parallel=args.num_parallel,  seed=args.seed,
+                     record_dir=args.record_dir if len(args.record_dir) != 0 else None)
 
 with open(os.path.join(args.pol_dir, args.pol_fname), 'rb') as f:
     pol.load_state_dict(torch.load(
         f, map_location=lambda storage, location: storage))
 
 
-epis = sampler.sample(pol, max_epis=args.num_epis)
+if len(args.record_dir) != 0:
+    # Workers write epis to disk, so only rewards are kept in memory.
+    rewards = []
+    while len(rewards) < args.num_epis:
+        epis = sampler.sample(pol, max_epis=min(
+            args.epis_per_sample, args.num_epis - len(rewards)))
+        rewards += [np.sum(epi['rews']) for epi in epis]
+    logger.log('{} epis are recorded to {}'.format(
+        len(rewards), args.record_dir))
+else:
+    epis = sampler.sample(pol, max_epis=args.num_epis)
 
-filename = args.epis_fname if len(
-    args.epis_fname) != 0 else env.env.spec.id + '_{}epis.pkl'.format(len(epis))
-with open(os.path.join(args.epis_dir, filename), 'wb') as f:
-    pickle.dump(epis, f)
-rewards = [np.sum(epi['rews']) for epi in epis]
+    filename = args.epis_fname if len(
+        args.epis_fname) != 0 else env.env.spec.id + '_{}epis.pkl'.format(len(epis))
+    with open(os.path.join(args.epis_dir, filename), 'wb') as f:
+        pickle.dump(epis, f)
+    rewards = [np.sum(epi['rews']) for epi in epis]
 mean_rew = np.mean(rewards)
 logger.log('expert_score={}'.format(mean_rew))
 del sampler
@@ -19,6 +19,7 @@ from machina.envs import GymEnv, C2DEnv
 from machina.traj import Traj
 from machina.traj import epi_functional as ef
 from machina.samplers import EpiSampler
+from machina.samplers.epi_dataset import iterate_epis, load_traj, num_epis
 from machina import logger
 from machina.utils import measure, set_device
 
@@ -43,6 +44,8 @@ parser.add_argument('--cuda', type=int, default=-1, help='cuda device number.')
 parser.add_argument('--expert_dir', type=str, default='../data/expert_epis')
 parser.add_argument('--expert_fname', type=str,
                     default='Pendulum-v0_100epis.pkl')
+parser.add_argument('--expert_record_dir', type=str, default='',
+                    help='If specified, expert epis are loaded from files recorded by make_expert_epis.py with --record_dir.')
 
 parser.add_argument('--max_epis_per_iter', type=int,
                     default=10, help='Number of episodes in an iteration.')
@@ -111,17 +114,25 @@ else:
 sampler = EpiSampler(env, pol, num_parallel=args.num_parallel, seed=args.seed)
 optim_pol = torch.optim.Adam(pol_net.parameters(), args.pol_lr)
 
-with open(os.path.join(args.expert_dir, args.expert_fname), 'rb') as f:
-    expert_epis = pickle.load(f)
-train_epis, test_epis = ef.train_test_split(
-    expert_epis, train_size=args.train_size)
-train_traj = Traj()
-train_traj.add_epis(train_epis)
-train_traj.register_epis()
-test_traj = Traj()
-test_traj.add_epis(test_epis)
-test_traj.register_epis()
-expert_rewards = [np.sum(epi['rews']) for epi in expert_epis]
+if len(args.expert_record_dir) != 0:
+    # Arrays of trajs are memory mapped, and epis are not made.
+    num_train = int(num_epis(args.expert_record_dir) * args.train_size)
+    train_traj = load_traj(args.expert_record_dir, end_epi=num_train)
+    test_traj = load_traj(args.expert_record_dir, start_epi=num_train)
+    expert_rewards = [np.sum(epi['rews'])
+                      for epi in iterate_epis(args.expert_record_dir)]
+else:
+    with open(os.path.join(args.expert_dir, args.expert_fname), 'rb') as f:
+        expert_epis = pickle.load(f)
+    train_epis, test_epis = ef.train_test_split(
+        expert_epis, train_size=args.train_size)
+    train_traj = Traj()
+    train_traj.add_epis(train_epis)
+    train_traj.register_epis()
+    test_traj = Traj()
+    test_traj.add_epis(test_epis)
+    test_traj.register_epis()
+    expert_rewards = [np.sum(epi['rews']) for epi in expert_epis]
 expert_mean_rew = np.mean(expert_rewards)
 logger.log('expert_score={}'.format(expert_mean_rew))
 logger.log('num_train_epi={}'.format(train_traj.num_epi))
@@ -23,6 +23,7 @@ from machina.envs import GymEnv, C2DEnv
 from machina.traj import Traj
 from machina.traj import epi_functional as ef
 from machina.samplers import EpiSampler
+from machina.samplers.epi_dataset import iterate_epis, load_traj
 from machina import logger
 from machina.utils import measure, set_device
 
@@ -48,6 +49,8 @@ parser.add_argument('--expert_dir', type=str, default='../data/expert_epis',
                     help='Directory path storing file of expert trajectory.')
 parser.add_argument('--expert_fname', type=str,
                     default='Pendulum-v0_100epis.pkl', help='Name of pkl file of expert trajectory')
+parser.add_argument('--expert_record_dir', type=str, default='',
+                    help='If specified, expert trajectory is loaded from files recorded by make_expert_epis.py with --record_dir.')
 
 parser.add_argument('--max_steps_per_iter', type=int, default=50000,
                     help='Number of steps to use in an iteration.')
@@ -163,12 +166,17 @@ optim_pol = torch.optim.Adam(pol_net.parameters(), args.pol_lr)
 optim_vf = torch.optim.Adam(vf_net.parameters(), args.vf_lr)
 optim_discrim = torch.optim.Adam(discrim_net.parameters(), args.discrim_lr)
 
-with open(os.path.join(args.expert_dir, args.expert_fname), 'rb') as f:
-    expert_epis = pickle.load(f)
-expert_traj = Traj()
-expert_traj.add_epis(expert_epis)
-expert_traj.register_epis()
-expert_rewards = [np.sum(epi['rews']) for epi in expert_epis]
+if len(args.expert_record_dir) != 0:
+    expert_traj = load_traj(args.expert_record_dir)
+    expert_rewards = [np.sum(epi['rews'])
+                      for epi in iterate_epis(args.expert_record_dir)]
+else:
+    with open(os.path.join(args.expert_dir, args.expert_fname), 'rb') as f:
+        expert_epis = pickle.load(f)
+    expert_traj = Traj()
+    expert_traj.add_epis(expert_epis)
+    expert_traj.register_epis()
+    expert_rewards = [np.sum(epi['rews']) for epi in expert_epis]
 expert_mean_rew = np.mean(expert_rewards)
 logger.log('expert_score={}'.format(expert_mean_rew))
 logger.log('expert_num_epi={}'.format(expert_traj.num_epi))
@@ -20,7 +20,7 @@ from machina.vfuncs import DeterministicSVfunc
 from machina.envs import GymEnv, C2DEnv
 from machina.traj import Traj
 from machina.traj import epi_functional as ef
-from machina.samplers import EpiSampler
+from machina.samplers import CoreBudget, EpiSampler
 from machina import logger
 from machina.utils import measure, set_device
 
@@ -41,6 +41,10 @@ parser.add_argument('--max_epis', type=int,
 parser.add_argument('--num_parallel', type=int, default=4,
                     help='Number of processes to sample.')
 parser.add_argument('--cuda', type=int, default=-1, help='cuda device number.')
+parser.add_argument('--learner_cpus', type=int, default=None,
+                    help='Number of CPUs reserved for the learner. If specified, samplers are pinned to the other CPUs.')
+parser.add_argument('--learner_threads', type=int, default=None,
+                    help='Number of threads of torch in the learner. default: learner_cpus.')
 
 parser.add_argument('--max_steps_per_iter', type=int, default=10000,
                     help='Number of steps to use in an iteration.')
@@ -127,7 +131,12 @@ else:
     vf_net = VNet(observation_space)
 vf = DeterministicSVfunc(observation_space, vf_net, args.rnn)
 
-sampler = EpiSampler(env, pol, num_parallel=args.num_parallel, seed=args.seed)
+core_budget = CoreBudget(
+    args.learner_cpus, args.learner_threads) if args.learner_cpus is not None else None
+sampler = EpiSampler(env, pol, num_parallel=args.num_parallel,
+                     seed=args.seed, core_budget=core_budget)
+if core_budget is not None:
+    core_budget.pin_learner()
 
 optim_pol = torch.optim.Adam(pol_net.parameters(), args.pol_lr)
 optim_vf = torch.optim.Adam(vf_net.parameters(), args.vf_lr)
@@ -61,6 +61,7 @@ from machina.envs import GymEnv, C2DEnv
 from machina.traj import Traj
 from machina.traj import epi_functional as ef
 from machina.traj import traj_functional as tf
+from machina.samplers import CoreBudget
 from machina.samplers.raysampler import EpiSampler
 from machina import logger
 from machina.utils import measure, init_ray
@@ -170,8 +171,12 @@ def main(args):
 
     trainer = TrainManager(Trainer, args.num_trainer, args.master_address,
                            args=args, vf=vf, pol=pol)
+    core_budget = CoreBudget(
+        args.learner_cpus, args.learner_threads) if args.learner_cpus is not None else None
+    if core_budget is not None:
+        core_budget.pin_learner()
     sampler = EpiSampler(env, pol,
-                         args.num_parallel, seed=args.seed)
+                         args.num_parallel, seed=args.seed, core_budget=core_budget)
 
     total_epi = 0
     total_step = 0
@@ -292,6 +297,10 @@ if __name__ == "__main__":
                         help='Number of CPUs that ray manages. Only effective when launching ray locally. default: all CPUs available.')
     parser.add_argument('--num_trainer', type=int, default=1,
                         help='Number of trainers (number of GPUs to train).')
+    parser.add_argument('--learner_cpus', type=int, default=None,
+                        help='Number of CPUs reserved for the learner. If specified, samplers are pinned to the other CPUs.')
+    parser.add_argument('--learner_threads', type=int, default=None,
+                        help='Number of threads of torch in the learner. default: learner_cpus.')
     args = parser.parse_args()
 
     main(args)
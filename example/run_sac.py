@@ -45,6 +45,8 @@ parser.add_argument('--max_steps_off', type=int,
 parser.add_argument('--num_parallel', type=int, default=4,
                     help='Number of processes to sample.')
 parser.add_argument('--cuda', type=int, default=-1, help='cuda device number.')
+parser.add_argument('--sample_async', action='store_true', default=False,
+                    help='If True, next episodes are sampled while training.')
 
 parser.add_argument('--max_steps_per_iter', type=int, default=10000,
                     help='Number of steps to use in an iteration.')
@@ -127,9 +129,16 @@ total_epi = 0
 total_step = 0
 max_rew = -1e6
 
+if args.sample_async:
+    future = sampler.sample_async(pol, max_steps=args.max_steps_per_iter)
 while args.max_epis > total_epi:
     with measure('sample'):
-        epis = sampler.sample(pol, max_steps=args.max_steps_per_iter)
+        if args.sample_async:
+            epis = future.result()
+            future = sampler.sample_async(
+                pol, max_steps=args.max_steps_per_iter)
+        else:
+            epis = sampler.sample(pol, max_steps=args.max_steps_per_iter)
 
     with measure('train'):
         on_traj = Traj(traj_device='cpu')
@@ -4,3 +4,4 @@ from machina.envs.ac_in_ob_env import AcInObEnv
 from machina.envs.rew_in_ob_env import RewInObEnv
 from machina.envs.skill_env import SkillEnv
 from machina.envs.env_utils import flatten_to_dict
+from machina.envs.synthetic_env import SyntheticEnv
@@ -0,0 +1,86 @@
+"""
+Synthetic environment whose cost is controllable, for benchmarking samplers.
+"""
+
+import time
+
+import gym
+import numpy as np
+
+
+class SyntheticEnv(gym.Env):
+    """
+    Deterministic environment with configurable observation size, episode length and cost of a step.
+    Observations are a fixed linear function of the previous observation and the action,
+    and the reward is the negative squared norm of the action.
+
+    Parameters
+    ----------
+    ob_dim : int
+        Dimension of observations.
+    ac_dim : int
+        Dimension of actions.
+    epi_length : int
+        Every episode has this number of steps.
+    step_cost : float
+        Seconds spent in each step.
+    release_gil : bool
+        If True, step_cost is spent by sleeping, which releases the GIL
+        like simulators running native code. Threads can overlap such steps.
+        If False, step_cost is spent by busy waiting in python, which holds the GIL and a CPU.
+    seed : int
+        Seed of the initial observation. The same seed gives the same episodes for the same actions.
+    """
+
+    def __init__(self, ob_dim=8, ac_dim=2, epi_length=100, step_cost=0., release_gil=False, seed=0):
+        self.ob_dim = ob_dim
+        self.ac_dim = ac_dim
+        self.epi_length = epi_length
+        self.step_cost = step_cost
+        self.release_gil = release_gil
+        self.original_env = self
+
+        self.observation_space = gym.spaces.Box(
+            low=-np.inf, high=np.inf, shape=(ob_dim, ), dtype=np.float32)
+        self.action_space = gym.spaces.Box(
+            low=-1., high=1., shape=(ac_dim, ), dtype=np.float32)
+
+        # Dynamics do not depend on the seed, so that copies of the env are the same task.
+        random_state = np.random.RandomState(0)
+        self.ob_mat = (0.9 * np.eye(ob_dim)).astype(np.float32)
+        self.ac_mat = (random_state.randn(ob_dim, ac_dim) /
+                       np.sqrt(ac_dim)).astype(np.float32)
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.random_state = np.random.RandomState(seed)
+        return [seed]
+
+    def _spend(self):
+        if self.step_cost <= 0:
+            return
+        if self.release_gil:
+            time.sleep(self.step_cost)
+            return
+        end = time.perf_counter() + self.step_cost
+        while time.perf_counter() < end:
+            pass
+
+    def reset(self):
+        self.t = 0
+        self.ob = self.random_state.uniform(-1., 1.,
+                                            self.ob_dim).astype(np.float32)
+        return self.ob.copy()
+
+    def step(self, ac):
+        self._spend()
+        ac = np.asarray(ac, dtype=np.float32).reshape(self.ac_dim)
+        ac = np.clip(ac, -1., 1.)
+        self.ob = self.ob_mat.dot(self.ob) + self.ac_mat.dot(ac)
+        self.t += 1
+        rew = -float(np.sum(ac ** 2))
+        done = self.t >= self.epi_length
+        return self.ob.copy(), rew, done, {}
+
+    def render(self, mode='human'):
+        pass
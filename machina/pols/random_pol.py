@@ -27,8 +27,10 @@ class RandomPol(BasePol):
                          normalize_ac=normalize_ac)
 
     def forward(self, ob):
+        batch_shape = tuple(ob.shape[:len(ob.shape) -
+                                     len(self.observation_space.shape)])
         ac_real = np.random.uniform(
-            self.action_space.low, self.action_space.high, self.action_space.shape).astype(np.float32)
+            self.action_space.low, self.action_space.high, batch_shape + self.action_space.shape).astype(np.float32)
         ac = torch.tensor(ac_real)
         mean = torch.zeros_like(ac)
         return ac_real, ac, dict(mean=mean)
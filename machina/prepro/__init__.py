@@ -1 +1,2 @@
 from machina.prepro.base import BasePrePro
+from machina.prepro.running_stats import RunningStats
@@ -10,20 +10,50 @@ class BasePrePro(object):
     ----------
     observation_space : gym.Space
     normalize_ob : bool
+    running_stats : RunningStats or None
+        If given, observations are merged to it in batches of update_interval,
+        and the mean and variance of it are used.
+        It is shared by copies of this object in sampling processes.
+        Otherwise, exponential moving average of observations is used.
+    update_interval : int
+        Number of observations in a batch merged to running_stats.
     """
 
-    def __init__(self, observation_space, normalize_ob=True):
+    def __init__(self, observation_space, normalize_ob=True, running_stats=None, update_interval=100):
         self.observation_space = observation_space
         self.normalize_ob = normalize_ob
+        self.running_stats = running_stats
+        self.update_interval = update_interval
+        self.obs = []
         if self.normalize_ob:
             self.ob_rm = np.zeros(self.observation_space.shape)
             self.ob_rv = np.ones(self.observation_space.shape)
             self.alpha = 0.001
+            if running_stats is not None:
+                self.sync()
+
+    def sync(self):
+        """
+        Merging stored observations to running_stats, and reading its mean and variance.
+        This is done under the lock of running_stats,
+        because sampling threads share this object.
+        """
+        with self.running_stats.lock:
+            obs, self.obs = self.obs, []
+            self.running_stats.update(obs)
+            count, mean, var = self.running_stats.snapshot()
+            if count > 0:
+                self.ob_rm, self.ob_rv = mean, var
 
     def update_ob_rms(self, ob):
         """
         Updating running mean and running variance.
         """
+        if self.running_stats is not None:
+            self.obs.append(ob)
+            if len(self.obs) >= self.update_interval:
+                self.sync()
+            return
         self.ob_rm = self.ob_rm * (1-self.alpha) + self.alpha * ob
         self.ob_rv = self.ob_rv * (1-self.alpha) + \
             self.alpha * np.square(ob-self.ob_rm)
@@ -0,0 +1,84 @@
+from multiprocessing.context import get_spawning_popen
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+
+class RunningStats(object):
+    """
+    Running mean and variance of observations in shared memory.
+    Batches of observations from several processes are merged
+    by the parallel algorithm of Welford's method, so the statistics are
+    the exact mean and variance of all observations.
+
+    `lock` is reentrant, and is also used by BasePrePro for its buffered observations,
+    so that threads and processes are synchronized in the same way.
+    When this is pickled except for starting a process (e.g. by cloudpickle for other machines),
+    the lock is not pickled and a new one is made.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of an observation.
+    """
+
+    def __init__(self, shape):
+        self.count = torch.zeros((), dtype=torch.float64).share_memory_()
+        self.mean = torch.zeros(shape, dtype=torch.float64).share_memory_()
+        self.m2 = torch.zeros(shape, dtype=torch.float64).share_memory_()
+        self.lock = mp.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if get_spawning_popen() is None:
+            state['lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.lock is None:
+            self.lock = mp.RLock()
+
+    def update(self, obs):
+        """
+        Merging a batch of observations.
+
+        Parameters
+        ----------
+        obs : ndarray
+            Observations whose shape is (batch_size, ) + shape.
+        """
+        obs = np.asarray(obs, dtype=np.float64)
+        count = len(obs)
+        if count == 0:
+            return
+        batch_mean = np.mean(obs, axis=0)
+        batch_m2 = np.sum(np.square(obs - batch_mean), axis=0)
+        with self.lock:
+            pre_count = self.count.item()
+            new_count = pre_count + count
+            mean = self.mean.numpy()
+            delta = batch_mean - mean
+            mean += delta * count / new_count
+            self.m2.numpy()[...] += batch_m2 + \
+                np.square(delta) * pre_count * count / new_count
+            self.count.fill_(new_count)
+
+    def snapshot(self):
+        """
+        Copying the current statistics.
+
+        Returns
+        -------
+        count, mean, var : float, ndarray, ndarray
+            var is ones if count is less than 2.
+        """
+        with self.lock:
+            count = self.count.item()
+            mean = self.mean.numpy().copy()
+            if count < 2:
+                var = np.ones_like(mean)
+            else:
+                var = self.m2.numpy() / count
+        return count, mean, var
@@ -5,3 +5,5 @@
 """
 from machina.samplers.epi_sampler import EpiSampler
 from machina.samplers.distributed_epi_sampler import DistributedEpiSampler
+from machina.samplers.eval_sampler import EvalSampler
+from machina.samplers.core_budget import CoreBudget
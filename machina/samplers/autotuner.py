@@ -0,0 +1,69 @@
+"""
+Autotuner of the number of workers and environments per worker of a sampler.
+"""
+
+import os
+
+from machina import logger
+
+
+class Autotuner(object):
+    """
+    Trying a configuration of a sampler in each sampling,
+    and choosing the configuration with the highest throughput.
+    Numbers of workers are powers of 2 up to the CPU budget, and the budget itself.
+
+    Parameters
+    ----------
+    max_workers : int
+    envs_per_worker_candidates : list of int
+    reserved_cpus : int
+        Number of CPUs reserved for training.
+        Number of workers is limited to `os.cpu_count() - reserved_cpus`.
+    """
+
+    def __init__(self, max_workers, envs_per_worker_candidates=(1, ), reserved_cpus=1):
+        budget = max(
+            1, min(max_workers, (os.cpu_count() or 1) - reserved_cpus))
+        nums = sorted(set([2 ** i for i in range(budget.bit_length())
+                           if 2 ** i <= budget] + [budget]))
+        self.candidates = [(num_workers, envs_per_worker)
+                           for envs_per_worker in envs_per_worker_candidates for num_workers in nums]
+        self.history = []
+        self.result = None
+
+    @property
+    def finished(self):
+        return self.result is not None
+
+    def next_config(self):
+        """
+        Returns
+        -------
+        num_workers, envs_per_worker : int, int
+            Configuration which should be measured next.
+        """
+        return self.candidates[len(self.history)]
+
+    def report(self, config, steps, seconds):
+        """
+        Reporting a measurement of a configuration.
+        After all candidates are measured, the best one is set to `result`.
+
+        Parameters
+        ----------
+        config : tuple of int
+            num_workers and envs_per_worker.
+        steps : float
+            Number of sampled steps.
+        seconds : float
+            Time of sampling.
+        """
+        num_workers, envs_per_worker = config
+        self.history.append(dict(num_workers=num_workers, envs_per_worker=envs_per_worker,
+                                 steps_per_sec=steps / seconds if seconds > 0 else 0.))
+        if len(self.history) == len(self.candidates):
+            self.result = max(
+                self.history, key=lambda h: h['steps_per_sec'])
+            logger.log('Autotuned sampler: num_workers={}, envs_per_worker={} ({:.1f} steps/sec)'.format(
+                self.result['num_workers'], self.result['envs_per_worker'], self.result['steps_per_sec']))
@@ -0,0 +1,83 @@
+"""
+Budget of CPU cores shared by sampling workers and the learner.
+"""
+
+import os
+
+import torch
+
+from machina import logger
+
+
+def _available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _set_affinity(cpus):
+    if not hasattr(os, 'sched_setaffinity'):
+        logger.log('CPU affinity is not supported on this platform.')
+        return
+    os.sched_setaffinity(0, cpus)
+
+
+class CoreBudget(object):
+    """
+    Splitting CPU cores into cores of the learner and cores of sampling workers,
+    so that they do not compete for the same cores.
+    The same budget is given to EpiSampler, workers of raysampler and the learner.
+
+    Parameters
+    ----------
+    learner_cpus : int
+        Number of cores reserved for the learner.
+        The first cores of `cpus` are used, which are usually on the same NUMA node.
+    learner_threads : int or None
+        Number of threads of torch in the learner.
+        If None, learner_cpus is used.
+    cpus : list of int or None
+        Cores which can be used. If None, cores available to this process are used.
+        Cores are resolved when the budget is made,
+        so give them explicitly for workers on other machines.
+    """
+
+    def __init__(self, learner_cpus=1, learner_threads=None, cpus=None):
+        if cpus is None:
+            cpus = _available_cpus()
+        cpus = list(cpus)
+        if learner_cpus < 0 or learner_cpus > len(cpus):
+            raise ValueError(
+                'learner_cpus should be between 0 and {}'.format(len(cpus)))
+        self.cpus = cpus
+        self.learner_cpus = cpus[:learner_cpus]
+        self.learner_threads = learner_threads if learner_threads is not None else max(
+            1, learner_cpus)
+        # All cores are shared if no core is left for workers.
+        self.worker_cpus = cpus[learner_cpus:] or cpus
+
+    def cpus_of_worker(self, worker_id):
+        """
+        Returns
+        -------
+        cpus : list of int
+            A core to which a worker is pinned.
+            Workers are assigned to worker_cpus in round robin.
+        """
+        return [self.worker_cpus[worker_id % len(self.worker_cpus)]]
+
+    def pin_worker(self, worker_id):
+        """
+        Pinning the calling process to the core of a worker with a single thread of torch.
+        """
+        _set_affinity(self.cpus_of_worker(worker_id))
+        torch.set_num_threads(1)
+
+    def pin_learner(self):
+        """
+        Pinning the calling process to learner_cpus, and setting threads of torch to learner_threads.
+        If no core is reserved, only threads of torch are set.
+        """
+        if self.learner_cpus:
+            _set_affinity(self.learner_cpus)
+        torch.set_num_threads(self.learner_threads)
@@ -4,19 +4,43 @@ This sampler uses redis for the backend.
 """
 
 import argparse
+import math
 import time
 
 import cloudpickle
+import numpy as np
 import redis
+import torch
 
+from machina import logger
 from machina.samplers import EpiSampler
-from machina.utils import _int, get_redis, make_redis
+from machina.samplers.epi_buffer import decode_epis, encode_epis
+from machina.samplers.sampler_stats import record_stats
+from machina.samplers.shared_params import flatten_params, load_flat_params
+from machina.utils import decode_arrays, encode_arrays, get_redis, make_redis
+
+
+KEY_PREFIX = 'DistributedEpiSampler'
+RESULT_KEY = KEY_PREFIX + '_result'
+
+
+def _command_key(rank):
+    return KEY_PREFIX + '_command_{}'.format(rank)
 
 
 class DistributedEpiSampler(object):
     """
     A sampler which sample episodes.
 
+    The master node and sampling nodes communicate by redis lists.
+    env and pol are pickled and sent only at startup.
+    In each sampling, the master pushes one command to the list of each node in one round trip,
+    and each node pushes its epis and stats to the result list, which the master pops.
+    Epis are encoded by machina.samplers.epi_buffer.encode_epis.
+    A command has parameters of pol in a flat buffer with a version.
+    Parameters are sent only if they are changed, and nodes load them only if the version is new.
+    Nodes and the master block on lists, so that they react as soon as a message is pushed.
+
     Parameters
     ----------
     world_size : int
@@ -29,9 +53,22 @@ class DistributedEpiSampler(object):
         Number of processes
     prepro : Prepro
     seed : int
+    flush_db : bool
+        If True, messages which are left in redis by previous runs are deleted.
+        This should not be set if other nodes may have started already.
+    compression : str or None
+        Compression of epis sent by nodes. None, 'lz4' or 'zstd'.
+        Packages for them are required in nodes and the master.
+    param_dtype : str or None
+        dtype of parameters sent to nodes, e.g. 'float16'.
+        If None, the dtype of parameters is used.
+    param_delta : bool
+        If True, differences from the parameters which nodes have are sent.
+        Rounding errors of param_dtype are corrected by the next difference.
     """
 
-    def __init__(self, world_size, rank=-1, env=None, pol=None, num_parallel=8, prepro=None, seed=256, flush_db=False):
+    def __init__(self, world_size, rank=-1, env=None, pol=None, num_parallel=8, prepro=None, seed=256, flush_db=False, compression=None,
+                 param_dtype=None, param_delta=False):
         if rank < 0:
             assert env is not None and pol is not None
 
@@ -42,30 +79,39 @@ class DistributedEpiSampler(object):
 
         if flush_db:
             # reset DB
-            keys = self.r.keys(pattern="*_trigger_*")
+            keys = self.r.keys(pattern=KEY_PREFIX + "*")
             if keys:
                 self.r.delete(*keys)
 
         if rank < 0:
-            self.env = env
-            self.pol = pol
             self.num_parallel = num_parallel // world_size
-            self.prepro = prepro
-            self.seed = seed
-
             self.original_num_parallel = num_parallel
-
-        self.scatter_from_master('env')
-        self.scatter_from_master('pol')
-        self.scatter_from_master('num_parallel')
-        self.scatter_from_master('prepro')
-        self.scatter_from_master('seed')
-
-        self.seed = self.seed * (self.rank + 23000)
-
-        if not rank < 0:
+            self.worker_stats = []
+            self.param_dtype = getattr(
+                torch, param_dtype) if param_dtype is not None else None
+            self.param_delta = param_delta
+            self.pol_version = 0
+            # parameters of the last sampling, and parameters which nodes have
+            self.last_params = flatten_params(pol)
+            self.node_flat = self.last_params[0].clone()
+            self.node_versions = [0] * world_size
+            self.iteration = 0
+            # rank -> iteration and time of the command which the node is sampling
+            self.busy = dict()
+            self.node_worker_stats = dict()
+            self.node_latencies = [dict(num_results=0, num_late=0, last_latency=0., total_latency=0., max_latency=0.)
+                                   for _ in range(world_size)]
+            self.scatter_from_master(dict(
+                env=env, pol=pol, num_parallel=self.num_parallel, prepro=prepro, seed=seed, compression=compression))
+        else:
+            config = self.recv_from_master()
+            self.seed = config['seed'] * (self.rank + 23000)
+            self.compression = config['compression']
+            self.pol = config['pol']
+            self.pol_version = 0
+            self.flat, _ = flatten_params(self.pol)
             self.in_node_sampler = EpiSampler(
-                self.env, self.pol, self.num_parallel, self.prepro, self.seed)
+                config['env'], config['pol'], config['num_parallel'], config['prepro'], self.seed)
             self.launch_sampler()
 
     def __del__(self):
@@ -74,121 +120,251 @@ class DistributedEpiSampler(object):
 
     def launch_sampler(self):
         while True:
-            self.scatter_from_master('pol')
-            self.scatter_from_master('max_epis')
-            self.scatter_from_master('max_steps')
-            self.scatter_from_master('deterministic')
+            _, payload = self.r.blpop(_command_key(self.rank))
+            arrays, command = decode_arrays(payload)
+            self.load_params(dict(arrays), command)
 
-            self.epis = self.in_node_sampler.sample(
-                self.pol, self.max_epis, self.max_steps, self.deterministic)
+            epis = self.in_node_sampler.sample(
+                self.pol, command['max_epis'], command['max_steps'], command['deterministic'])
 
-            self.gather_to_master('epis')
+            worker_stats = [dict(stat, rank=self.rank)
+                            for stat in self.in_node_sampler.stats()]
+            self.r.rpush(RESULT_KEY, encode_epis(
+                epis, dict(rank=self.rank, iteration=command['iteration'], worker_stats=worker_stats), self.compression))
 
-    def sync(self, keys, target_value):
-        """Wait until all `keys` become `target_value`
+    def load_params(self, arrays, command):
         """
-        while True:
-            values = self.r.mget(keys)
-            if all([_int(v) == target_value for v in values]):
-                break
-            time.sleep(0.1)
-
-    def wait_trigger(self, trigger):
-        """Wait until `trigger` become 1
+        sampler: load parameters in a command to pol if its version is new
         """
-        self.sync(trigger, 1)
-
-    def wait_trigger_processed(self, trigger):
-        """Wait until `trigger` become 0
+        if command['version'] == self.pol_version or 'flat' not in arrays:
+            return
+        flat = torch.from_numpy(arrays['flat'].astype(
+            self.flat.numpy().dtype))
+        self.flat = self.flat + flat if command['delta'] else flat
+        others = [torch.from_numpy(np.array(arrays[('other', i)]))
+                  for i in range(len(arrays) - 1)]
+        load_flat_params(self.pol, self.flat, others)
+        self.pol_version = command['version']
+
+    def update_params(self, pol):
         """
-        self.sync(trigger, 0)
+        master: increment the version if parameters of pol are changed
 
-    def set_trigger(self, trigger, value='1'):
-        """Set all triggers to `value`
+        Returns
+        -------
+        arrays : list
+            Parameters for nodes which have the previous version.
+            Empty if parameters are not changed.
         """
-        if not isinstance(trigger, (list, tuple)):
-            trigger = [trigger]
-        mapping = {k: value for k in trigger}
-        self.r.mset(mapping)
+        flat, others = flatten_params(pol)
+        last_flat, last_others = self.last_params
+        changed = not torch.equal(flat, last_flat) or not all(
+            [torch.equal(o, lo) for o, lo in zip(others, last_others)])
+        if not changed:
+            return []
+        self.pol_version += 1
+        self.last_params = (flat, others)
+        values = flat - self.node_flat if self.param_delta else flat
+        if self.param_dtype is not None:
+            values = values.to(self.param_dtype)
+        # Nodes have values after rounding to param_dtype.
+        if self.param_delta:
+            self.node_flat = self.node_flat + values.to(flat.dtype)
+        else:
+            self.node_flat = values.to(flat.dtype)
+        return [('flat', values.numpy())] + [(['other', i], o.numpy()) for i, o in enumerate(others)]
 
-    def reset_trigger(self, trigger):
-        """Set all triggers to 0
+    def make_command(self, arrays, delta, max_epis, max_steps, deterministic):
         """
-        self.set_trigger(trigger, value='0')
-
-    def wait_trigger_completion(self, trigger):
-        """Set trigger to 1, then wait until it become 0
+        master: encode a command of sampling
         """
-        self.set_trigger(trigger)
-        self.wait_trigger_processed(trigger)
+        return encode_arrays(arrays, dict(version=self.pol_version, iteration=self.iteration, delta=delta,
+                                          max_epis=max_epis, max_steps=max_steps, deterministic=deterministic))
 
-    def scatter_from_master(self, key):
+    def scatter_from_master(self, obj, ranks=None):
+        """
+        master: push `obj` to the list of each node in one round trip
+        `obj` is pickled unless it is bytes.
+        If ranks is given, `obj` is pushed only to them.
         """
-        master: set `key` to DB, then set trigger and wait sampler completion
-        sampler: wait trigger, then get `key` and reset trigger
+        payload = obj if isinstance(
+            obj, bytes) else cloudpickle.dumps(obj)
+        pipe = self.r.pipeline(transaction=False)
+        for rank in range(self.world_size) if ranks is None else ranks:
+            pipe.rpush(_command_key(rank), payload)
+        pipe.execute()
+
+    def recv_from_master(self):
         """
+        sampler: block until the master pushes a pickled object
+        """
+        _, payload = self.r.blpop(_command_key(self.rank))
+        return cloudpickle.loads(payload)
 
-        if self.rank < 0:
-            obj = getattr(self, key)
-            self.r.set(key, cloudpickle.dumps(obj))
-            trigger = ['{}_trigger_{}'.format(
-                key, rank) for rank in range(self.world_size)]
-            self.wait_trigger_completion(trigger)
-        else:
-            trigger = '{}_trigger_{}'.format(key, self.rank)
-            self.wait_trigger(trigger)
-            obj = cloudpickle.loads(self.r.get(key))
-            setattr(self, key, obj)
-            self.reset_trigger(trigger)
-
-    def gather_to_master(self, key):
-        """
-        master: wait trigger, then get the value from DB
-        sampler: set `key` to DB, then wait master fetch
-
-        This method assume that obj is summable to list.
-        """
-
-        if self.rank < 0:
-            num_done = 0
-            objs = []
-            while True:
-                time.sleep(0.1)
-                # This for iteration can be faster.
-                for rank in range(self.world_size):
-                    trigger = self.r.get(key + '_trigger' + "_{}".format(rank))
-                    if _int(trigger) == 1:
-                        obj = cloudpickle.loads(
-                            self.r.get(key + "_{}".format(rank)))
-                        objs += obj
-                        self.r.set(key + '_trigger' + "_{}".format(rank), '0')
-                        num_done += 1
-                if num_done == self.world_size:
-                    break
-            setattr(self, key, objs)
-        else:
-            obj = getattr(self, key)
-            self.r.set(key + "_{}".format(self.rank), cloudpickle.dumps(obj))
-            trigger = '{}_trigger_{}'.format(key, self.rank)
-            self.wait_trigger_completion(trigger)
+    def gather_iter(self, timeout=None):
+        """
+        master: yield rank, epis and worker_stats of each busy node as soon as the node pushes them
+        If timeout seconds pass, stop waiting. Results of the other nodes are yielded in the next call.
+        Results of nodes which are not busy or of other iterations (e.g. left in redis by previous runs)
+        are discarded.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.busy:
+            if deadline is None:
+                _, payload = self.r.blpop(RESULT_KEY)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                # Redis before 6.0 accepts only integer timeouts.
+                result = self.r.blpop(
+                    RESULT_KEY, timeout=max(1, int(math.ceil(remaining))))
+                if result is None:
+                    return
+                _, payload = result
+            epis, meta = decode_epis(payload)
+            rank = meta['rank']
+            busy = self.busy.pop(rank, None)
+            if busy is None or busy[0] != meta.get('iteration'):
+                if busy is not None:
+                    self.busy[rank] = busy
+                logger.log('A result of node {} of iteration {} is discarded.'.format(
+                    rank, meta.get('iteration')))
+                continue
+            iteration, sent_time = busy
+            self._record_node(rank, time.time() - sent_time,
+                              iteration != self.iteration)
+            yield rank, epis, meta['worker_stats']
+
+    def _record_node(self, rank, latency, late):
+        stat = self.node_latencies[rank]
+        stat['num_results'] += 1
+        stat['num_late'] += int(late)
+        stat['last_latency'] = latency
+        stat['total_latency'] += latency
+        stat['max_latency'] = max(stat['max_latency'], latency)
+
+    def sample(self, pol, max_epis=None, max_steps=None, deterministic=False, quorum=None, timeout=None):
+        """
+        This method should be called in master node.
+        See `stream` for quorum and timeout.
+        """
+        for _ in self.stream(pol, max_epis, max_steps, deterministic, quorum, timeout):
+            pass
+        return self.epis
 
-    def sample(self, pol, max_epis=None, max_steps=None, deterministic=False):
+    def stream(self, pol, max_epis=None, max_steps=None, deterministic=False, quorum=None, timeout=None):
         """
+        Yielding epis of each node as soon as the node finishes sampling.
+        After all epis are yielded, `epis` has epis of all nodes.
         This method should be called in master node.
+
+        Nodes which have not finished the previous sampling are not given a new command,
+        and their epis are yielded in this sampling when they arrive.
+
+        Parameters
+        ----------
+        pol : Pol
+        max_epis : int or None
+        max_steps : int or None
+        deterministic : bool
+        quorum : float or None
+            If given, stop waiting when this fraction of max_steps (or max_epis if max_steps is None) has arrived.
+            Epis of the other nodes are yielded in the next sampling.
+        timeout : float or None
+            If given, stop waiting after this number of seconds.
+            Epis of the other nodes are yielded in the next sampling.
+        """
+        self.iteration += 1
+        version = self.pol_version
+        arrays = self.update_params(pol)
+        max_epis_per_node = max_epis // self.world_size if max_epis is not None else None
+        max_steps_per_node = max_steps // self.world_size if max_steps is not None else None
+        ranks = [rank for rank in range(
+            self.world_size) if rank not in self.busy]
+        # Nodes which missed versions by being busy get all parameters.
+        lagging = [rank for rank in ranks if self.node_versions[rank] != version]
+        updated = [rank for rank in ranks if rank not in lagging]
+        if updated:
+            self.scatter_from_master(self.make_command(
+                arrays, self.param_delta, max_epis_per_node, max_steps_per_node, deterministic), updated)
+        if lagging:
+            full_arrays = [('flat', self.node_flat.numpy())] + \
+                [(['other', i], o.numpy())
+                 for i, o in enumerate(self.last_params[1])]
+            self.scatter_from_master(self.make_command(
+                full_arrays, False, max_epis_per_node, max_steps_per_node, deterministic), lagging)
+        sent_time = time.time()
+        for rank in ranks:
+            self.node_versions[rank] = self.pol_version
+            self.busy[rank] = (self.iteration, sent_time)
+
+        budget = max_steps if max_steps is not None else max_epis
+        self.epis = []
+        arrived = 0
+        for rank, epis, stats in self.gather_iter(timeout):
+            self.epis += epis
+            self.node_worker_stats[rank] = stats
+            for epi in epis:
+                yield epi
+            arrived += sum([len(epi['rews']) for epi in epis]
+                           ) if max_steps is not None else len(epis)
+            if quorum is not None and budget is not None and arrived >= quorum * budget:
+                break
+        self.worker_stats = sum([self.node_worker_stats[rank]
+                                 for rank in sorted(self.node_worker_stats.keys())], [])
+
+    def stats(self, record=False):
         """
-        self.pol = pol
-        self.max_epis = max_epis // self.world_size if max_epis is not None else None
-        self.max_steps = max_steps // self.world_size if max_steps is not None else None
-        self.deterministic = deterministic
+        Counters of each worker of all nodes, which are gathered in the last sampling.
+        For nodes which did not finish in the last sampling, counters of their last result are used.
+        This method should be called in master node.
 
-        self.scatter_from_master('pol')
-        self.scatter_from_master('max_epis')
-        self.scatter_from_master('max_steps')
-        self.scatter_from_master('deterministic')
+        Parameters
+        ----------
+        record : bool
+            If True, sums over workers are recorded by logger.record_tabular.
 
-        self.gather_to_master('epis')
+        Returns
+        -------
+        stats : list of dict
+            Counters of each worker with `rank` of the node.
+        """
+        if record:
+            record_stats(self.worker_stats)
+        return self.worker_stats
 
-        return self.epis
+    def node_stats(self, record=False):
+        """
+        Latencies from sending a command to receiving epis of each node.
+        This method should be called in master node.
+
+        Parameters
+        ----------
+        record : bool
+            If True, the mean and maximum of last latencies over nodes and the number of busy nodes
+            are recorded by logger.record_tabular.
+
+        Returns
+        -------
+        stats : list of dict
+            `rank`, `num_results`, `num_late` (results which arrived after their sampling),
+            `last_latency`, `mean_latency`, `max_latency` and `busy` of each node.
+        """
+        stats = []
+        for rank in range(self.world_size):
+            stat = self.node_latencies[rank]
+            stats.append(dict(rank=rank, num_results=stat['num_results'], num_late=stat['num_late'],
+                              last_latency=stat['last_latency'], max_latency=stat['max_latency'],
+                              mean_latency=stat['total_latency'] /
+                              stat['num_results'] if stat['num_results'] > 0 else 0.,
+                              busy=rank in self.busy))
+        if record:
+            latencies = [stat['last_latency'] for stat in stats]
+            logger.record_tabular('NodeLatencyMean', np.mean(latencies))
+            logger.record_tabular('NodeLatencyMax', np.max(latencies))
+            logger.record_tabular('NodeBusy', len(self.busy))
+        return stats
 
 
 if __name__ == '__main__':
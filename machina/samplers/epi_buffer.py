@@ -0,0 +1,240 @@
+"""
+Buffers for passing episodes from sampling processes to the master process.
+"""
+
+import numpy as np
+import torch
+
+from machina.traj.traj import EPI_INFO_KEYS
+from machina.utils import decode_arrays, encode_arrays
+
+
+EPI_KEYS = ['obs', 'acs', 'rews', 'dones']
+EPI_DICT_KEYS = ['a_is', 'e_is']
+
+
+def flatten_epi(epi):
+    """
+    Flattening an episode to a dict whose keys are tuples.
+
+    Parameters
+    ----------
+    epi : dict
+
+    Returns
+    -------
+    flat_epi : dict of ndarray
+    """
+    flat_epi = dict()
+    for key in EPI_KEYS:
+        flat_epi[(key, )] = epi[key]
+    for key in EPI_INFO_KEYS:
+        if key in epi:
+            flat_epi[('info', key)] = np.asarray(epi[key])
+    for key in EPI_DICT_KEYS:
+        for sub_key in epi[key]:
+            flat_epi[(key, sub_key)] = epi[key][sub_key]
+    return flat_epi
+
+
+def unflatten_epi(flat_epi):
+    """
+    Inverse of flatten_epi.
+
+    Parameters
+    ----------
+    flat_epi : dict of ndarray
+
+    Returns
+    -------
+    epi : dict
+    """
+    epi = dict([(key, dict()) for key in EPI_DICT_KEYS])
+    for key, value in flat_epi.items():
+        if len(key) == 1:
+            epi[key[0]] = value
+        elif key[0] == 'info':
+            epi[key[1]] = value.item() if value.ndim == 0 else value
+        else:
+            epi[key[0]][key[1]] = value
+    return epi
+
+
+class SharedEpiBuffer(object):
+    """
+    Buffer in shared memory to which a sampling process writes episodes.
+    Episodes are stored contiguously, and end index of each episode is stored in `epi_ends`.
+    Values of EPI_INFO_KEYS are stored per episode.
+    If an episode does not fit into the buffer, the buffer is reallocated with doubled size.
+    After reallocation, `updated` is True and the new tensors have to be sent to the reader.
+
+    Parameters
+    ----------
+    capacity : int
+        Initial number of steps which can be stored.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.data_map = None
+        self.epi_ends = None
+        self.num_step = 0
+        self.num_epi = 0
+        self.updated = False
+
+    def reset(self):
+        self.num_step = 0
+        self.num_epi = 0
+
+    def _allocate(self, flat_epi, capacity):
+        data_map = dict()
+        for key, value in flat_epi.items():
+            value = np.asarray(value)
+            if key[0] == 'info':
+                value = value[None]
+            data_map[key] = torch.zeros(
+                (capacity, ) + value.shape[1:], dtype=torch.from_numpy(value).dtype).share_memory_()
+        epi_ends = torch.zeros(capacity, dtype=torch.long).share_memory_()
+        if self.data_map is not None:
+            for key in data_map:
+                num = self.num_epi if key[0] == 'info' else self.num_step
+                data_map[key][:num] = self.data_map[key][:num]
+            epi_ends[:self.num_epi] = self.epi_ends[:self.num_epi]
+        self.data_map = data_map
+        self.epi_ends = epi_ends
+        self.capacity = capacity
+        self.updated = True
+
+    def _fits(self, flat_epi):
+        if self.data_map is None or set(self.data_map.keys()) != set(flat_epi.keys()):
+            return False
+        for key, value in flat_epi.items():
+            shape = np.shape(
+                value) if key[0] == 'info' else np.shape(value)[1:]
+            if tuple(self.data_map[key].shape[1:]) != shape:
+                return False
+        return True
+
+    def add_epi(self, epi):
+        """
+        Writing an episode to the buffer.
+
+        Parameters
+        ----------
+        epi : dict
+        """
+        flat_epi = flatten_epi(epi)
+        l = len(epi['rews'])
+        if not self._fits(flat_epi):
+            if self.num_epi > 0:
+                raise ValueError(
+                    'Keys and shapes of episodes should be same in one sampling.')
+            self.data_map = None
+            self._allocate(flat_epi, max(self.capacity, l))
+        elif self.num_step + l > self.capacity:
+            self._allocate(flat_epi, max(
+                2 * self.capacity, self.num_step + l))
+        for key, value in flat_epi.items():
+            value = torch.from_numpy(np.asarray(value))
+            if key[0] == 'info':
+                self.data_map[key][self.num_epi] = value
+            else:
+                self.data_map[key][self.num_step:self.num_step + l] = value
+        self.num_step += l
+        self.epi_ends[self.num_epi] = self.num_step
+        self.num_epi += 1
+
+    def tensors(self):
+        """
+        Tensors which have to be sent to the reader.
+
+        Returns
+        -------
+        tensors : tuple of dict of torch.Tensor and torch.Tensor
+        """
+        return self.data_map, self.epi_ends
+
+
+def read_epis(tensors, num_epi, start_epi=0):
+    """
+    Making episodes which are views of tensors in SharedEpiBuffer.
+    The views are valid until the buffer is written again.
+
+    Parameters
+    ----------
+    tensors : tuple of dict of torch.Tensor and torch.Tensor
+        Returned value of SharedEpiBuffer.tensors.
+    num_epi : int
+    start_epi : int
+        Episodes before start_epi are not read.
+
+    Returns
+    -------
+    epis : list of dict
+    """
+    data_map, epi_ends = tensors
+    epis = []
+    start = int(epi_ends[start_epi - 1]) if start_epi > 0 else 0
+    for i, end in enumerate(epi_ends[start_epi:num_epi].tolist(), start_epi):
+        epis.append(unflatten_epi(dict(
+            [(key, value[i].numpy() if key[0] == 'info' else value[start:end].numpy()) for key, value in data_map.items()])))
+        start = end
+    return epis
+
+
+def encode_epis(epis, meta=None, compression=None):
+    """
+    Encoding episodes to bytes by machina.utils.encode_arrays.
+    Arrays of each key are concatenated over episodes, and ends of episodes are stored.
+    Keys and shapes of episodes should be same.
+
+    Parameters
+    ----------
+    epis : list of dict
+    meta : dict or None
+        json serializable values which are sent with episodes.
+    compression : str or None
+        None, 'lz4' or 'zstd'.
+
+    Returns
+    -------
+    data : bytes
+    """
+    epi_ends = np.cumsum([len(epi['rews']) for epi in epis], dtype=np.int64)
+    arrays = [('epi_ends', epi_ends)]
+    if epis:
+        flat_epis = [flatten_epi(epi) for epi in epis]
+        for key in flat_epis[0]:
+            if key[0] == 'info':
+                value = np.stack([flat_epi[key] for flat_epi in flat_epis])
+            else:
+                value = np.concatenate([flat_epi[key]
+                                        for flat_epi in flat_epis])
+            arrays.append((list(key), value))
+    return encode_arrays(arrays, meta, compression)
+
+
+def decode_epis(data):
+    """
+    Inverse of encode_epis.
+    Without compression, arrays of episodes are read-only views of data.
+
+    Parameters
+    ----------
+    data : bytes
+
+    Returns
+    -------
+    epis : list of dict
+    meta : dict or None
+    """
+    arrays, meta = decode_arrays(data)
+    arrays = dict(arrays)
+    epi_ends = arrays.pop('epi_ends')
+    epis = []
+    start = 0
+    for i, end in enumerate(epi_ends.tolist()):
+        epis.append(unflatten_epi(dict(
+            [(key, value[i] if key[0] == 'info' else value[start:end]) for key, value in arrays.items()])))
+        start = end
+    return epis, meta
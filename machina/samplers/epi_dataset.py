@@ -0,0 +1,287 @@
+"""
+Sharded on-disk dataset of episodes.
+Each sampling worker appends finished episodes to its own shard,
+and shards are read by memory mapping, so that neither recording nor loading holds all episodes in memory.
+
+A shard is a directory with
+ - meta.json: keys, dtypes and shapes of arrays,
+ - data_{i}.bin: raw arrays of the i-th key, concatenated over episodes,
+ - index.bin: int64 end of each episode in steps.
+Values of EPI_INFO_KEYS are stored per episode.
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+
+from machina.samplers.epi_buffer import flatten_epi, unflatten_epi
+from machina.traj import Traj
+from machina.traj.traj import COMPACT_DTYPES
+
+
+META_FNAME = 'meta.json'
+INDEX_FNAME = 'index.bin'
+
+
+def _data_fname(i):
+    return 'data_{}.bin'.format(i)
+
+
+def _shard_order(name):
+    prefix, _, index = name.rpartition('_')
+    if index.isdigit():
+        return (prefix, int(index))
+    return (name, -1)
+
+
+def shard_dirs(record_dir):
+    """
+    Returns
+    -------
+    dirs : list of str
+        Directories of shards in record_dir,
+        sorted by index of shards (e.g. shard_2 comes before shard_10).
+    """
+    if not os.path.isdir(record_dir):
+        return []
+    return [os.path.join(record_dir, name) for name in sorted(os.listdir(record_dir), key=_shard_order)
+            if os.path.exists(os.path.join(record_dir, name, META_FNAME))]
+
+
+class EpiShardWriter(object):
+    """
+    Appending episodes to a shard.
+    If the shard exists, episodes are appended after the recorded ones.
+    Data which is written after the last complete episode (e.g. by a killed process) is discarded.
+
+    Parameters
+    ----------
+    shard_dir : str
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        os.makedirs(shard_dir, exist_ok=True)
+        self.keys = None
+        self.files = None
+        self.index_file = None
+        self.num_step = 0
+        self.num_epi = 0
+        if os.path.exists(os.path.join(shard_dir, META_FNAME)):
+            self._open(_load_meta(shard_dir))
+
+    def _open(self, meta):
+        self.keys = [tuple(key) for key in meta['keys']]
+        self.dtypes = [np.dtype(dtype) for dtype in meta['dtypes']]
+        self.shapes = [tuple(shape) for shape in meta['shapes']]
+        index_path = os.path.join(self.shard_dir, INDEX_FNAME)
+        epi_ends = np.fromfile(index_path, dtype=np.int64) if os.path.exists(
+            index_path) else np.zeros(0, dtype=np.int64)
+        self.num_epi = len(epi_ends)
+        self.num_step = int(epi_ends[-1]) if self.num_epi > 0 else 0
+        self.files = []
+        for i, key in enumerate(self.keys):
+            num = self.num_epi if key[0] == 'info' else self.num_step
+            path = os.path.join(self.shard_dir, _data_fname(i))
+            f = open(path, 'ab')
+            f.truncate(num * self.dtypes[i].itemsize *
+                       int(np.prod(self.shapes[i])))
+            self.files.append(f)
+        self.index_file = open(index_path, 'ab')
+        self.index_file.truncate(self.num_epi * 8)
+
+    def _create(self, flat_epi):
+        keys = sorted(flat_epi.keys())
+        values = [np.asarray(flat_epi[key]) for key in keys]
+        meta = dict(keys=[list(key) for key in keys],
+                    dtypes=[value.dtype.str for value in values],
+                    shapes=[list(value.shape if key[0] == 'info' else value.shape[1:]) for key, value in zip(keys, values)])
+        with open(os.path.join(self.shard_dir, META_FNAME), 'w') as f:
+            json.dump(meta, f)
+        self._open(meta)
+
+    def write(self, epi):
+        """
+        Appending an episode.
+
+        Parameters
+        ----------
+        epi : dict
+        """
+        flat_epi = flatten_epi(epi)
+        if self.keys is None:
+            self._create(flat_epi)
+        if set(flat_epi.keys()) != set(self.keys):
+            raise ValueError(
+                'Keys of episodes should be same in a shard.')
+        l = len(epi['rews'])
+        for f, key, dtype in zip(self.files, self.keys, self.dtypes):
+            f.write(np.ascontiguousarray(flat_epi[key], dtype=dtype).tobytes())
+            f.flush()
+        self.num_step += l
+        self.num_epi += 1
+        # The index is written last, so that an episode is visible only after its data is written.
+        self.index_file.write(np.int64(self.num_step).tobytes())
+        self.index_file.flush()
+
+    def close(self):
+        if self.files is not None:
+            for f in self.files + [self.index_file]:
+                f.close()
+            self.files = None
+
+    def __del__(self):
+        self.close()
+
+
+def _load_meta(shard_dir):
+    with open(os.path.join(shard_dir, META_FNAME)) as f:
+        return json.load(f)
+
+
+def read_shard(shard_dir):
+    """
+    Memory mapping a shard.
+    Episodes which are being written are not included.
+
+    Parameters
+    ----------
+    shard_dir : str
+
+    Returns
+    -------
+    data_map : dict of np.memmap
+        Keys are flattened keys of episodes. See machina.samplers.epi_buffer.flatten_epi.
+        Arrays are copy-on-write, so that writing to them does not change files.
+    epi_ends : ndarray
+    """
+    meta = _load_meta(shard_dir)
+    index_path = os.path.join(shard_dir, INDEX_FNAME)
+    epi_ends = np.fromfile(index_path, dtype=np.int64) if os.path.exists(
+        index_path) else np.zeros(0, dtype=np.int64)
+    num_step = int(epi_ends[-1]) if len(epi_ends) > 0 else 0
+    data_map = dict()
+    for i, (key, dtype, shape) in enumerate(zip(meta['keys'], meta['dtypes'], meta['shapes'])):
+        key = tuple(key)
+        num = len(epi_ends) if key[0] == 'info' else num_step
+        shape = (num, ) + tuple(shape)
+        if num == 0:
+            data_map[key] = np.zeros(shape, dtype=dtype)
+        else:
+            data_map[key] = np.memmap(os.path.join(
+                shard_dir, _data_fname(i)), dtype=dtype, mode='c', shape=shape)
+    return data_map, epi_ends
+
+
+def iterate_epis(record_dir):
+    """
+    Yielding recorded episodes of all shards in record_dir.
+    Arrays of episodes are memory mapped.
+
+    Parameters
+    ----------
+    record_dir : str
+
+    Returns
+    -------
+    epi : dict
+        This function is a generator yielding episodes.
+    """
+    for shard_dir in shard_dirs(record_dir):
+        data_map, epi_ends = read_shard(shard_dir)
+        start = 0
+        for i, end in enumerate(epi_ends.tolist()):
+            yield unflatten_epi(dict([(key, value[i] if key[0] == 'info' else value[start:end])
+                                      for key, value in data_map.items()]))
+            start = end
+
+
+def num_epis(record_dir):
+    """
+    Returns
+    -------
+    num_epi : int
+        Number of recorded episodes of all shards in record_dir.
+    """
+    return sum([len(read_shard(shard_dir)[1]) for shard_dir in shard_dirs(record_dir)])
+
+
+def load_traj(record_dir, traj=None, start_epi=0, end_epi=None, tmp_dir=None):
+    """
+    Registering recorded episodes to Traj without making episodes.
+    If the episodes are in one shard and traj is on cpu, arrays of Traj are memory mapped
+    (except arrays whose dtypes are not float32 or compact dtypes, which are cast to float32).
+    Otherwise, shards are copied one by one to a memory mapped temporary file,
+    so that memory is not bounded by the size of the episodes.
+
+    Parameters
+    ----------
+    record_dir : str
+    traj : Traj or None
+        Traj to which episodes are added. If None, a new Traj on cpu is made.
+    start_epi : int
+    end_epi : int or None
+        Only episodes from start_epi to end_epi (exclusive) are loaded.
+        Episodes are numbered in the order of shard_dirs.
+        If None, episodes until the last one are loaded.
+    tmp_dir : str or None
+        Directory of the temporary file. If None, record_dir is used.
+
+    Returns
+    -------
+    traj : Traj
+    """
+    if traj is None:
+        traj = Traj(traj_device='cpu')
+    selected = []
+    offset = 0
+    for shard_dir in shard_dirs(record_dir):
+        data_map, epi_ends = read_shard(shard_dir)
+        start = max(start_epi - offset, 0)
+        end = len(epi_ends) if end_epi is None else min(
+            end_epi - offset, len(epi_ends))
+        offset += len(epi_ends)
+        if start >= end:
+            continue
+        start_step = int(epi_ends[start - 1]) if start > 0 else 0
+        selected.append((data_map, start_step, epi_ends[start:end]))
+    if not selected:
+        return traj
+    num_step = sum([int(epi_ends[-1]) - start_step
+                    for _, start_step, epi_ends in selected])
+    arrays = dict()
+    for key, value in selected[0][0].items():
+        if key[0] == 'info':
+            continue
+        name = key[0] if len(key) == 1 else key[1]
+        dtype = value.dtype
+        if dtype not in COMPACT_DTYPES and dtype != np.float32:
+            dtype = np.dtype(np.float32)
+        if len(selected) == 1 and dtype == value.dtype:
+            _, start_step, epi_ends = selected[0]
+            array = value[start_step:int(epi_ends[-1])]
+        else:
+            tmp_file = tempfile.TemporaryFile(
+                dir=record_dir if tmp_dir is None else tmp_dir)
+            array = np.memmap(tmp_file, dtype=dtype, mode='w+',
+                              shape=(num_step, ) + value.shape[1:])
+            pos = 0
+            for data_map, start_step, epi_ends in selected:
+                l = int(epi_ends[-1]) - start_step
+                array[pos:pos + l] = data_map[key][start_step:start_step + l]
+                pos += l
+            array.flush()
+        arrays[name] = torch.from_numpy(array)
+    epis_index = [[0]]
+    pos = 0
+    for _, start_step, epi_ends in selected:
+        epis_index.append(epi_ends - start_step + pos)
+        pos += int(epi_ends[-1]) - start_step
+    new_traj = Traj()
+    new_traj.data_map = arrays
+    new_traj._epis_index = np.concatenate(epis_index)
+    traj.add_traj(new_traj)
+    return traj
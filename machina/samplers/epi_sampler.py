@@ -2,21 +2,50 @@
 Sampler class
 """
 
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from contextlib import contextmanager
 import copy
+from multiprocessing.connection import wait as connection_wait
+import os
+import queue
+import signal
+import threading
 import time
+import weakref
 
 import gym
 import numpy as np
 import torch
 import torch.multiprocessing as mp
 
+from machina import logger
+from machina.samplers.autotuner import Autotuner
+from machina.samplers.epi_buffer import SharedEpiBuffer, read_epis
+from machina.samplers.epi_dataset import EpiShardWriter
+from machina.samplers.inference_pol import InferencePol
+from machina.samplers.inference_server import InferenceClient, make_inference_buffers, mp_inference
+from machina.samplers.rollout_buffer import RolloutBuffer, _to_numpy
+from machina.samplers.sampler_stats import STAT_KEYS, WorkerStats, make_stats_values, record_stats, stats_to_dicts
+from machina.samplers.shared_params import SharedParams
 from machina.utils import cpu_mode
 
 
 LARGE_NUMBER = 100000000
 
 
-def one_epi(env, pol, deterministic=False, prepro=None):
+def epi_capacity(env, default=1000):
+    """
+    Initial capacity of RolloutBuffer for env,
+    which is the maximum length of episodes if it is known.
+    """
+    horizon = getattr(env, 'horizon', None)
+    if horizon is None:
+        horizon = getattr(getattr(env, 'spec', None),
+                          'max_episode_steps', None)
+    return horizon if horizon is not None else default
+
+
+def one_epi(env, pol, deterministic=False, prepro=None, rollout_buffer=None, stats=None):
     """
     Sampling an episode.
 
@@ -27,6 +56,12 @@ def one_epi(env, pol, deterministic=False, prepro=None):
     deterministic : bool
         If True, policy is deterministic.
     prepro : Prepro
+    rollout_buffer : RolloutBuffer or None
+        Buffer to which steps are written.
+        If given, arrays of epi are views of it, which are overwritten by the next call.
+        If None, a new buffer sized by epi_capacity is used, and arrays of epi are copies.
+    stats : WorkerStats or None
+        Times and numbers of steps and episodes are added to it.
 
     Returns
     -------
@@ -35,67 +70,348 @@ def one_epi(env, pol, deterministic=False, prepro=None):
     with cpu_mode():
         if prepro is None:
             def prepro(x): return x
-        obs = []
-        acs = []
-        rews = []
-        dones = []
-        a_is = []
-        e_is = []
+        copy_epi = rollout_buffer is None
+        if rollout_buffer is None:
+            rollout_buffer = RolloutBuffer(
+                pol.action_space.shape, pol.a_i_shape, capacity=epi_capacity(env))
+        if stats is None:
+            stats = WorkerStats()
+        rollout_buffer.reset()
+        t0 = time.perf_counter()
         o = env.reset()
+        stats.env_time += time.perf_counter() - t0
         pol.reset()
         done = False
         epi_length = 0
         while not done:
+            t0 = time.perf_counter()
             o = prepro(o)
+            t1 = time.perf_counter()
             if not deterministic:
                 ac_real, ac, a_i = pol(torch.tensor(o, dtype=torch.float))
             else:
                 ac_real, ac, a_i = pol.deterministic_ac_real(
                     torch.tensor(o, dtype=torch.float))
             ac_real = ac_real.reshape(pol.action_space.shape)
+            t2 = time.perf_counter()
             next_o, r, done, e_i = env.step(np.array(ac_real))
-            obs.append(o)
-            rews.append(r)
-            dones.append(done)
-            acs.append(ac.squeeze().detach().cpu(
-            ).numpy().reshape(pol.action_space.shape))
+            t3 = time.perf_counter()
+            stats.prepro_time += t1 - t0
+            stats.pol_time += t2 - t1
+            stats.env_time += t3 - t2
+            rollout_buffer.add(o, ac, r, done, a_i, e_i)
+            epi_length += 1
+            if done:
+                break
+            o = next_o
+        stats.steps += epi_length
+        stats.epis += 1
+        return epi_length, rollout_buffer.epi(copy_epi)
+
+
+def pol_step(pol, o, deterministic=False):
+    """
+    Computing an action for an observation.
+
+    Parameters
+    ----------
+    pol : Pol
+    o : ndarray
+    deterministic : bool
+        If True, policy is deterministic.
+
+    Returns
+    -------
+    ac_real, ac, a_i : ndarray, ndarray, dict of ndarray
+    """
+    if not deterministic:
+        ac_real, ac, a_i = pol(torch.tensor(o, dtype=torch.float))
+    else:
+        ac_real, ac, a_i = pol.deterministic_ac_real(
+            torch.tensor(o, dtype=torch.float))
+    ac_real = np.array(ac_real.reshape(pol.action_space.shape))
+    ac = _to_numpy(ac).reshape(pol.action_space.shape)
+    _a_i = dict()
+    for key in a_i.keys():
+        if a_i[key] is None:
+            continue
+        if isinstance(a_i[key], tuple):
+            _a_i[key] = tuple([_to_numpy(h).squeeze()
+                               for h in a_i[key]])
+        else:
+            _a_i[key] = _to_numpy(a_i[key]).reshape(pol.a_i_shape)
+    return ac_real, ac, _a_i
+
+
+def one_fragment(env, pol, num_steps, state, deterministic=False, prepro=None, e_i_keys=None, stats=None, dtypes=None):
+    """
+    Sampling a fixed number of steps.
+    An episode which is not finished is continued in the next call.
+    Steps are split into segments at the end of episodes.
+
+    Parameters
+    ----------
+    env : gym.Env
+    pol : Pol
+    num_steps : int
+    state : dict
+        Keeps the observation of an unfinished episode between calls.
+    deterministic : bool
+        If True, policy is deterministic.
+    prepro : Prepro
+    e_i_keys : list of str or None
+        Keys of env info which are stored.
+        If None, all keys are stored.
+    stats : WorkerStats or None
+        Times and numbers of steps and episodes are added to it.
+    dtypes : dict or None
+        dtypes of stored arrays for keys of episodes ('obs', 'acs', 'rews', 'dones')
+        and keys of a_is and e_is. Unspecified arrays are float32.
+
+    Returns
+    -------
+    segs : list of dict
+        Each segment has `truncated` and `last_ob` in addition to keys of an episode.
+        `truncated` is True if the episode continues after the segment.
+        `last_ob` is the observation after the last step of the segment.
+    """
+    with cpu_mode():
+        if prepro is None:
+            def prepro(x): return x
+        if stats is None:
+            stats = WorkerStats()
+        segs = []
+        seg = None
+        for _ in range(num_steps):
+            if state.get('o') is None:
+                t0 = time.perf_counter()
+                o = env.reset()
+                t1 = time.perf_counter()
+                state['o'] = prepro(o)
+                stats.env_time += t1 - t0
+                stats.prepro_time += time.perf_counter() - t1
+                pol.reset()
+            if seg is None:
+                seg = dict(obs=[], acs=[], rews=[],
+                           dones=[], a_is=[], e_is=[])
+            o = state['o']
+            t0 = time.perf_counter()
+            ac_real, ac, a_i = pol_step(pol, o, deterministic)
+            t1 = time.perf_counter()
+            next_o, r, done, e_i = env.step(ac_real)
+            stats.pol_time += t1 - t0
+            stats.env_time += time.perf_counter() - t1
+            seg['obs'].append(o)
+            seg['rews'].append(r)
+            seg['dones'].append(done)
+            seg['acs'].append(ac)
+            seg['a_is'].append(a_i)
+            seg['e_is'].append(e_i)
+            if done:
+                epi = make_epi(e_i_keys=e_i_keys, dtypes=dtypes, **seg)
+                epi['truncated'] = False
+                epi['last_ob'] = np.zeros_like(epi['obs'][-1])
+                segs.append(epi)
+                stats.epis += 1
+                state['o'] = None
+                seg = None
+            else:
+                t0 = time.perf_counter()
+                state['o'] = prepro(next_o)
+                stats.prepro_time += time.perf_counter() - t0
+        if seg is not None:
+            epi = make_epi(e_i_keys=e_i_keys, dtypes=dtypes, **seg)
+            epi['truncated'] = True
+            epi['last_ob'] = np.array(state['o'], dtype='float32')
+            segs.append(epi)
+        stats.steps += num_steps
+        return segs
+
+
+def make_epi(obs, acs, rews, dones, a_is, e_is, e_i_keys=None, dtypes=None):
+    """
+    Making an episode from lists of steps.
+
+    Parameters
+    ----------
+    e_i_keys : list of str or None
+        Keys of env info which are stored.
+        If None, all keys are stored.
+    dtypes : dict or None
+        dtypes of stored arrays for keys of episodes ('obs', 'acs', 'rews', 'dones')
+        and keys of a_is and e_is. Unspecified arrays are float32.
+
+    Returns
+    -------
+    epi : dict
+    """
+    if e_i_keys is None:
+        e_i_keys = e_is[0].keys()
+    else:
+        e_i_keys = [key for key in e_i_keys if key in e_is[0]]
+    if dtypes is None:
+        dtypes = dict()
+    return dict(
+        obs=np.array(obs, dtype=dtypes.get('obs', 'float32')),
+        acs=np.array(acs, dtype=dtypes.get('acs', 'float32')),
+        rews=np.array(rews, dtype=dtypes.get('rews', 'float32')),
+        dones=np.array(dones, dtype=dtypes.get('dones', 'float32')),
+        a_is=dict([(key, np.array([a_i[key] for a_i in a_is], dtype=dtypes.get(key, 'float32')))
+                   for key in a_is[0].keys()]),
+        e_is=dict([(key, np.array([e_i[key] for e_i in e_is], dtype=dtypes.get(key, 'float32')))
+                   for key in e_i_keys])
+    )
+
+
+def make_envs(env, num_envs, seed=256):
+    """
+    Making copies of an environment for batched sampling.
+    Each copy is seeded differently so that copies do not share a random stream.
+
+    Parameters
+    ----------
+    env : gym.Env
+    num_envs : int
+    seed : int
+
+    Returns
+    -------
+    envs : list of gym.Env
+    """
+    envs = []
+    for i in range(num_envs):
+        _env = copy.deepcopy(env)
+        if hasattr(_env, 'original_env'):
+            _env.original_env.seed(seed + i)
+        envs.append(_env)
+    return envs
+
+
+def batch_epis(envs, pol, deterministic=False, prepro=None, continue_sampling=None, e_i_keys=None, stats=None, dtypes=None):
+    """
+    Sampling episodes from several environments in lockstep.
+    Observations of all environments are stacked and passed to `pol` at once.
+    An environment whose episode ends is reset while `continue_sampling()` is True,
+    otherwise it stays idle until the remaining episodes end.
+
+    Parameters
+    ----------
+    envs : list of gym.Env
+    pol : Pol
+        Pol should accept batched observations.
+    deterministic : bool
+        If True, policy is deterministic.
+    prepro : Prepro
+    continue_sampling : function or None
+        Called before an episode is started. If None, each environment runs one episode.
+    e_i_keys : list of str or None
+        Keys of env info which are stored.
+        If None, all keys are stored.
+    stats : WorkerStats or None
+        Times and numbers of steps and episodes are added to it.
+    dtypes : dict or None
+        dtypes of stored arrays for keys of episodes ('obs', 'acs', 'rews', 'dones')
+        and keys of a_is and e_is. Unspecified arrays are float32.
+
+    Returns
+    -------
+    epi_length, epi : int, dict
+        This function is a generator yielding finished episodes.
+    """
+    with cpu_mode():
+        if prepro is None:
+            def prepro(x): return x
+        if stats is None:
+            stats = WorkerStats()
+
+        def reset(env):
+            t0 = time.perf_counter()
+            o = env.reset()
+            t1 = time.perf_counter()
+            o = prepro(o)
+            stats.env_time += t1 - t0
+            stats.prepro_time += time.perf_counter() - t1
+            return o
+
+        num_envs = len(envs)
+        ac_shape = (num_envs, ) + pol.action_space.shape
+        a_i_shape = (num_envs, ) + pol.a_i_shape
+        epis = [None] * num_envs
+        cur_obs = [None] * num_envs
+        h_masks = np.zeros((1, num_envs, 1), dtype='float32')
+        pol.reset()
+        for i, env in enumerate(envs):
+            if continue_sampling is None or continue_sampling():
+                cur_obs[i] = reset(env)
+                epis[i] = dict(obs=[], acs=[], rews=[],
+                               dones=[], a_is=[], e_is=[])
+                h_masks[0, i, 0] = 1
+        if all([epi is None for epi in epis]):
+            return
+        # Idle environments only fill the batch. Their outputs are ignored.
+        dummy_o = next(o for o in cur_obs if o is not None)
+        cur_obs = [o if o is not None else np.zeros_like(dummy_o)
+                   for o in cur_obs]
+        while any([epi is not None for epi in epis]):
+            t0 = time.perf_counter()
+            obs = torch.tensor(np.array(cur_obs), dtype=torch.float)
+            kwargs = dict(h_masks=torch.tensor(h_masks)) if pol.rnn else dict()
+            if not deterministic:
+                ac_real, ac, a_i = pol(obs, **kwargs)
+            else:
+                ac_real, ac, a_i = pol.deterministic_ac_real(obs, **kwargs)
+            h_masks[:] = 0
+            ac_real = np.array(ac_real).reshape(ac_shape)
+            acs = _to_numpy(ac).reshape(ac_shape)
             _a_i = dict()
             for key in a_i.keys():
                 if a_i[key] is None:
                     continue
                 if isinstance(a_i[key], tuple):
-                    _a_i[key] = tuple([h.squeeze().detach().cpu().numpy()
-                                       for h in a_i[key]])
+                    # Hidden states are (num_layers, num_envs, hidden_size).
+                    _a_i[key] = tuple([_to_numpy(h) for h in a_i[key]])
                 else:
-                    _a_i[key] = a_i[key].squeeze().detach(
-                    ).cpu().numpy().reshape(pol.a_i_shape)
-            a_i = _a_i
-            a_is.append(a_i)
-            e_is.append(e_i)
-            epi_length += 1
-            if done:
-                break
-            o = next_o
-        return epi_length, dict(
-            obs=np.array(obs, dtype='float32'),
-            acs=np.array(acs, dtype='float32'),
-            rews=np.array(rews, dtype='float32'),
-            dones=np.array(dones, dtype='float32'),
-            a_is=dict([(key, np.array([a_i[key] for a_i in a_is], dtype='float32'))
-                       for key in a_is[0].keys()]),
-            e_is=dict([(key, np.array([e_i[key] for e_i in e_is], dtype='float32'))
-                       for key in e_is[0].keys()])
-        )
+                    _a_i[key] = _to_numpy(a_i[key]).reshape(a_i_shape)
+            stats.pol_time += time.perf_counter() - t0
+            for i, env in enumerate(envs):
+                epi = epis[i]
+                if epi is None:
+                    continue
+                t0 = time.perf_counter()
+                next_o, r, done, e_i = env.step(ac_real[i])
+                stats.env_time += time.perf_counter() - t0
+                epi['obs'].append(cur_obs[i])
+                epi['rews'].append(r)
+                epi['dones'].append(done)
+                epi['acs'].append(acs[i])
+                epi['a_is'].append(dict([(key, tuple([h[:, i].squeeze() for h in v]) if isinstance(v, tuple) else v[i])
+                                         for key, v in _a_i.items()]))
+                epi['e_is'].append(e_i)
+                if not done:
+                    t0 = time.perf_counter()
+                    cur_obs[i] = prepro(next_o)
+                    stats.prepro_time += time.perf_counter() - t0
+                    continue
+                stats.steps += len(epi['rews'])
+                stats.epis += 1
+                yield len(epi['rews']), make_epi(e_i_keys=e_i_keys, dtypes=dtypes, **epi)
+                if continue_sampling is not None and continue_sampling():
+                    cur_obs[i] = reset(env)
+                    epis[i] = dict(obs=[], acs=[], rews=[],
+                                   dones=[], a_is=[], e_is=[])
+                    h_masks[0, i, 0] = 1
+                else:
+                    epis[i] = None
 
 
-def mp_sample(pol, env, max_steps, max_epis, n_steps_global, n_epis_global, epis, exec_flag, deterministic_flag, process_id, prepro=None, seed=256):
+def mp_sample(pol, env, max_steps, max_epis, n_steps_global, n_epis_global, lock, conn, exec_event, deterministic_flag, process_id, prepro=None, seed=256, envs_per_worker=1, fragment_length=None, e_i_keys=None, stats_values=None, pol_version=None, dtypes=None, stream_flag=None, core_budget=None, record_dir=None):
     """
     Multiprocess sample.
     Sampling episodes until max_steps or max_epis is achieved.
 
     Parameters
     ----------
-    pol : Pol
+    pol : Pol or InferenceClient
     env : gym.Env
     max_steps : int
         maximum steps of episodes
@@ -105,29 +421,515 @@ def mp_sample(pol, env, max_steps, max_epis, n_steps_global, n_epis_global, epis
         shared Tensor
     n_epis_global : torch.Tensor
         shared Tensor
-    epis : list
-        multiprocessing's list for sharing episodes between processes.
-    exec_flag : torch.Tensor
-        execution flag
+    lock : multiprocessing.Lock
+        Lock for n_steps_global and n_epis_global.
+    conn : multiprocessing.Connection
+        Number of sampled episodes and whether sampling is finished are sent when sampling is finished.
+        Tensors of SharedEpiBuffer are also sent when they are reallocated.
+        Two SharedEpiBuffers are used alternately,
+        so that episodes of the previous sampling are not overwritten.
+    exec_event : multiprocessing.Event
+        Set by master to start sampling.
     deterministic_flag : torch.Tensor
     process_id : int
     prepro : Prepro
     seed : int
+    envs_per_worker : int
+        If larger than 1, copies of env are sampled in lockstep with batched policy forward.
+    fragment_length : int or None
+        If not None, segments of at most fragment_length steps are sampled,
+        and steps are reserved before sampling so that exactly max_steps steps are sampled.
+    e_i_keys : list of str or None
+        Keys of env info which are stored.
+        If None, all keys are stored.
+    stats_values : torch.Tensor or None
+        Shared tensor to which counters of this process are added.
+        See machina.samplers.sampler_stats.
+    pol_version : torch.Tensor or None
+        Shared version of parameters of pol, which is recorded in episodes.
+    dtypes : dict or None
+        dtypes of stored arrays for keys of episodes ('obs', 'acs', 'rews', 'dones')
+        and keys of a_is and e_is. Unspecified arrays are float32.
+    stream_flag : torch.Tensor or None
+        If set, the number of sampled episodes is also sent whenever an episode is finished.
+    core_budget : CoreBudget or None
+        If given, this process is pinned to a core of workers.
+    record_dir : str or None
+        If given, sampled episodes are also appended to the shard `shard_{process_id}` in record_dir.
+        See machina.samplers.epi_dataset.
     """
 
     np.random.seed(seed + process_id)
     torch.manual_seed(seed + process_id)
-    torch.set_num_threads(1)
+    if core_budget is not None:
+        core_budget.pin_worker(process_id)
+    else:
+        torch.set_num_threads(1)
+
+    if envs_per_worker > 1:
+        envs = make_envs(env, envs_per_worker,
+                         seed + process_id * envs_per_worker)
+
+    counter = SampleCounter(n_steps_global, max_steps,
+                            n_epis_global, max_epis, lock, block_sigterm=True)
+    fragment_state = dict()
+    rollout_buffer = RolloutBuffer(
+        pol.action_space.shape, pol.a_i_shape, capacity=epi_capacity(env), e_i_keys=e_i_keys, dtypes=dtypes)
+    epi_buffers = [SharedEpiBuffer(), SharedEpiBuffer()]
+    stats = WorkerStats(stats_values)
+    epi_writer = EpiShardWriter(os.path.join(
+        record_dir, 'shard_{}'.format(process_id))) if record_dir is not None else None
+    buffer_id = 0
+
+    def send(epi_buffer, finished):
+        tensors = epi_buffer.tensors() if epi_buffer.updated else None
+        epi_buffer.updated = False
+        conn.send((buffer_id, epi_buffer.num_epi, tensors, finished))
 
     while True:
-        time.sleep(0.1)
-        if exec_flag > 0:
-            while max_steps > n_steps_global and max_epis > n_epis_global:
-                l, epi = one_epi(env, pol, deterministic_flag, prepro)
-                n_steps_global += l
-                n_epis_global += 1
-                epis.append(epi)
-            exec_flag.zero_()
+        t0 = time.perf_counter()
+        exec_event.wait()
+        exec_event.clear()
+        stats.idle_time += time.perf_counter() - t0
+        epi_buffer = epi_buffers[buffer_id]
+        epi_buffer.reset()
+        for epi in worker_epis(pol, env if envs_per_worker == 1 else envs, counter, deterministic_flag, prepro,
+                               fragment_length, fragment_state, rollout_buffer, e_i_keys, stats, pol_version, dtypes):
+            epi_buffer.add_epi(epi)
+            if epi_writer is not None:
+                epi_writer.write(epi)
+            if stream_flag is not None and stream_flag:
+                send(epi_buffer, False)
+        send(epi_buffer, True)
+        buffer_id = 1 - buffer_id
+
+
+class SampleCounter(object):
+    """
+    Counters of sampled steps and episodes shared by sampling workers.
+
+    Parameters
+    ----------
+    n_steps_global : torch.Tensor
+    max_steps : torch.Tensor
+    n_epis_global : torch.Tensor
+    max_epis : torch.Tensor
+    lock : multiprocessing.Lock or threading.Lock
+    block_sigterm : bool
+        If True, SIGTERM is blocked while the lock is held,
+        so that a sampling process which is terminated (e.g. on timeout) never dies holding the lock.
+        The signal is delivered when the lock is released.
+        This should be set only in sampling processes.
+    """
+
+    def __init__(self, n_steps_global, max_steps, n_epis_global, max_epis, lock, block_sigterm=False):
+        self.n_steps_global = n_steps_global
+        self.max_steps = max_steps
+        self.n_epis_global = n_epis_global
+        self.max_epis = max_epis
+        self.lock = lock
+        self.block_sigterm = block_sigterm and hasattr(
+            signal, 'pthread_sigmask')
+
+    @contextmanager
+    def _locked(self):
+        if self.block_sigterm:
+            signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGTERM])
+        try:
+            with self.lock:
+                yield
+        finally:
+            if self.block_sigterm:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGTERM])
+
+    def stop(self):
+        """
+        Stopping workers after their current episodes.
+        """
+        with self._locked():
+            self.max_epis.zero_()
+
+    def continue_sampling(self):
+        return bool(self.max_steps > self.n_steps_global and self.max_epis > self.n_epis_global)
+
+    def add(self, num_steps, finished=True):
+        with self._locked():
+            self.n_steps_global.add_(num_steps)
+            if finished:
+                self.n_epis_global.add_(1)
+
+    def reserve_steps(self, num_steps):
+        """
+        Reserving at most num_steps steps before sampling them.
+
+        Returns
+        -------
+        num_steps : int
+            Number of reserved steps.
+        """
+        with self._locked():
+            if self.max_epis <= self.n_epis_global:
+                return 0
+            num_steps = min(num_steps, int(
+                self.max_steps - self.n_steps_global))
+            if num_steps > 0:
+                self.n_steps_global.add_(num_steps)
+        return num_steps
+
+
+def _set_version(epi, version):
+    if version is not None:
+        epi['pol_version'] = version
+    return epi
+
+
+def worker_epis(pol, env, counter, deterministic=False, prepro=None, fragment_length=None, fragment_state=None, rollout_buffer=None, e_i_keys=None, stats=None, pol_version=None, dtypes=None, copy_epis=False):
+    """
+    Sampling episodes in a worker until counter says to stop.
+
+    Parameters
+    ----------
+    pol : Pol or InferenceClient
+    env : gym.Env or list of gym.Env
+        If list, envs are sampled in lockstep by batch_epis.
+    counter : SampleCounter
+    deterministic : bool
+    prepro : Prepro
+    fragment_length : int or None
+        If not None, segments are sampled by one_fragment.
+    fragment_state : dict or None
+        state of one_fragment.
+    rollout_buffer : RolloutBuffer or None
+        Buffer for one_epi, which is reused for all episodes.
+        If None, a buffer is made for this call.
+    e_i_keys : list of str or None
+    stats : WorkerStats or None
+        Counters are flushed when sampling is finished.
+    pol_version : torch.Tensor or None
+        Version of SharedParams of pol.
+        If given, the version at the start of sampling is set to `epi['pol_version']`.
+    dtypes : dict or None
+    copy_epis : bool
+        If True, episodes of one_epi are copied out of rollout_buffer.
+        Otherwise, each episode is valid until the next one is yielded.
+
+    Returns
+    -------
+    epi : dict
+        This function is a generator yielding episodes.
+    """
+    if stats is None:
+        stats = WorkerStats()
+    version = None if pol_version is None else int(pol_version)
+    start = time.perf_counter()
+    if fragment_length is not None:
+        num_steps = counter.reserve_steps(fragment_length)
+        while num_steps > 0:
+            for seg in one_fragment(env, pol, num_steps, fragment_state, deterministic, prepro, e_i_keys, stats, dtypes):
+                counter.add(0, not seg['truncated'])
+                yield _set_version(seg, version)
+            num_steps = counter.reserve_steps(fragment_length)
+    elif isinstance(env, list):
+        for l, epi in batch_epis(env, pol, deterministic, prepro, counter.continue_sampling, e_i_keys, stats, dtypes):
+            counter.add(l)
+            yield _set_version(epi, version)
+    else:
+        if rollout_buffer is None:
+            rollout_buffer = RolloutBuffer(
+                pol.action_space.shape, pol.a_i_shape, capacity=epi_capacity(env), e_i_keys=e_i_keys, dtypes=dtypes)
+        while counter.continue_sampling():
+            l, epi = one_epi(env, pol, deterministic,
+                             prepro, rollout_buffer, stats)
+            if copy_epis:
+                epi = rollout_buffer.epi(copy=True)
+            counter.add(l)
+            yield _set_version(epi, version)
+    stats.sample_time += time.perf_counter() - start
+    stats.flush()
+
+
+class SampleFuture(object):
+    """
+    Handle of sampling started by EpiSampler.sample_async.
+
+    Parameters
+    ----------
+    conns : list of multiprocessing.Connection
+        Connections to sampling processes.
+        This is updated when processes are restarted.
+    epi_buffers : list
+        Tensors of SharedEpiBuffers of each process.
+        This is updated when tensors are reallocated.
+    processes : list of multiprocessing.Process or None
+        Sampling processes, which are checked whether they are alive.
+    respawn : weakref.WeakMethod or None
+        Method which restarts a sampling process and returns indices of restarted processes.
+    inds : list of int or None
+        Indices of processes which sample. If None, all processes sample.
+    """
+
+    def __init__(self, conns, epi_buffers, processes=None, respawn=None, inds=None):
+        self.conns = conns
+        self.epi_buffers = epi_buffers
+        self.processes = processes
+        self.respawn = respawn
+        self.inds = list(range(len(conns))) if inds is None else inds
+        self.epis = None
+        self.failed_workers = []
+        self.pending = list(self.inds)
+        self.worker_epis = dict([(ind, []) for ind in self.inds])
+        self.finished = dict([(ind, False) for ind in self.inds])
+        # Epis received by done() which are not yielded by stream yet.
+        self.received_epis = []
+
+    def done(self):
+        """
+        Returns True if all processes finished sampling or died.
+        Messages which are waiting are received, so that
+        streamed episodes before the last message are not taken as finishing.
+        """
+        if self.epis is not None:
+            return True
+        for ind in self.pending:
+            if not self.finished[ind]:
+                epis, _ = self._receive(ind)
+                self.received_epis += epis
+        return all([self.finished[ind] or (self.processes is not None and not self.processes[ind].is_alive())
+                    for ind in self.pending])
+
+    def _fail(self, ind):
+        self.failed_workers.append(ind)
+        respawn = self.respawn() if self.respawn is not None else None
+        inds = [ind] if respawn is None else respawn(ind)
+        for i in inds:
+            if i in self.pending:
+                self.pending.remove(i)
+
+    def _receive(self, ind):
+        """
+        Receiving messages of a process.
+
+        Returns
+        -------
+        epis : list of dict
+            Episodes which are not received yet.
+        alive : bool
+            False if the process died without finishing sampling.
+        """
+        epis = []
+        while self.conns[ind].poll():
+            try:
+                buffer_id, num_epi, tensors, finished = self.conns[ind].recv()
+            except EOFError:
+                break
+            if tensors is not None:
+                self.epi_buffers[ind][buffer_id] = tensors
+            num_read = len(self.worker_epis[ind])
+            if num_epi > num_read:
+                new_epis = read_epis(
+                    self.epi_buffers[ind][buffer_id], num_epi, num_read)
+                self.worker_epis[ind] += new_epis
+                epis += new_epis
+            if finished:
+                self.finished[ind] = True
+                return epis, True
+        return epis, self.processes is None or self.processes[ind].is_alive()
+
+    def stream(self, timeout=None):
+        """
+        Yielding epis as soon as processes send them.
+        Processes send each episode only if sampling is started with `stream=True`.
+        Otherwise, epis of a process are yielded when the process finishes.
+        After all epis are yielded, `epis` is the same as `result()`.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Seconds to wait. See `result`.
+
+        Returns
+        -------
+        epi : dict
+            This method is a generator yielding epis.
+        """
+        if self.epis is not None:
+            return
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending:
+            while self.received_epis:
+                yield self.received_epis.pop(0)
+            for ind in list(self.pending):
+                if ind not in self.pending:
+                    continue
+                epis, alive = self._receive(ind)
+                for epi in epis:
+                    yield epi
+                if self.finished[ind]:
+                    self.pending.remove(ind)
+                    continue
+                if not alive and ind in self.pending:
+                    self._fail(ind)
+            if not self.pending:
+                break
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                for ind in list(self.pending):
+                    if ind in self.pending:
+                        self._fail(ind)
+                break
+            waitables = [self.conns[ind] for ind in self.pending]
+            if self.processes is not None:
+                waitables += [self.processes[ind].sentinel for ind in self.pending]
+            connection_wait(waitables, remaining)
+        while self.received_epis:
+            yield self.received_epis.pop(0)
+        if self.failed_workers:
+            logger.log('Sampling of processes {} failed.'.format(
+                sorted(self.failed_workers)))
+        self.epis = sum([self.worker_epis[ind]
+                         for ind in sorted(self.worker_epis.keys())], [])
+
+    def result(self, timeout=None):
+        """
+        Wait until all processes finish sampling.
+        A process which died is restarted with its env and seed,
+        and epis of the other processes are returned.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Seconds to wait. Processes which have not finished by then are
+            restarted, and epis of the other processes are returned.
+            If None, wait until all processes finish or die.
+
+        Returns
+        -------
+        epis : list of dict
+            Sampled epis.
+            Episodes which were sent by failed processes before they failed are also included.
+            Indices of processes which failed are in `failed_workers`.
+        """
+        for _ in self.stream(timeout):
+            pass
+        return self.epis
+
+
+def _put_epis(epis, epi_queue, epi_writer=None):
+    """
+    Collecting epis of a thread, which are also put to epi_queue.
+    None is put when the thread finishes.
+    If epi_writer is given, epis are also written to it.
+    """
+    collected = []
+    try:
+        for epi in epis:
+            if epi_writer is not None:
+                epi_writer.write(epi)
+            collected.append(epi)
+            epi_queue.put(epi)
+    finally:
+        epi_queue.put(None)
+    return collected
+
+
+class ThreadSampleFuture(object):
+    """
+    Handle of sampling started by EpiSampler.sample_async with thread backend.
+
+    Parameters
+    ----------
+    futures : list of concurrent.futures.Future
+        Futures of threads, each of which returns a list of epis.
+    counter : SampleCounter or None
+        Used to stop threads on timeout.
+    epi_queue : queue.Queue or None
+        Queue to which threads put epis. See `_put_epis`.
+    """
+
+    def __init__(self, futures, counter=None, epi_queue=None):
+        self.futures = futures
+        self.counter = counter
+        self.epi_queue = epi_queue
+        self.num_finished = 0
+        self.epis = None
+        self.failed_workers = []
+
+    def done(self):
+        """
+        Returns True if all threads finished sampling.
+        """
+        if self.epis is not None:
+            return True
+        return all([future.done() for future in self.futures])
+
+    def stream(self, timeout=None):
+        """
+        Yielding epis as soon as threads finish them.
+        After all epis are yielded, `epis` is the same as `result()`.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Seconds to wait. See `result`.
+
+        Returns
+        -------
+        epi : dict
+            This method is a generator yielding epis.
+        """
+        if self.epis is not None:
+            return
+        if self.epi_queue is None:
+            for epi in self.result(timeout):
+                yield epi
+            return
+        deadline = None if timeout is None else time.time() + timeout
+        while self.num_finished < len(self.futures):
+            remaining = None if deadline is None else max(
+                deadline - time.time(), 0)
+            try:
+                epi = self.epi_queue.get(timeout=remaining)
+            except queue.Empty:
+                if self.counter is not None:
+                    self.counter.stop()
+                deadline = None
+                continue
+            if epi is None:
+                self.num_finished += 1
+            else:
+                yield epi
+        self.result()
+
+    def result(self, timeout=None):
+        """
+        Wait until all threads finish sampling.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Seconds to wait. Threads can not be killed,
+            so threads which have not finished by then are stopped after their current episodes.
+
+        Returns
+        -------
+        epis : list of dict
+            Sampled epis.
+            Indices of threads which raised exceptions are in `failed_workers`.
+        """
+        if self.epis is None:
+            _, not_done = futures_wait(self.futures, timeout)
+            if not_done and self.counter is not None:
+                self.counter.stop()
+            epis = []
+            for ind, future in enumerate(self.futures):
+                try:
+                    epis += future.result()
+                except Exception as e:
+                    logger.log(
+                        'Sampling of thread {} failed: {}'.format(ind, repr(e)))
+                    self.failed_workers.append(ind)
+            self.epis = epis
+        return self.epis
 
 
 class EpiSampler(object):
@@ -142,42 +944,315 @@ class EpiSampler(object):
         Number of processes
     prepro : Prepro
     seed : int
+    envs_per_worker : int
+        Number of environments each process steps in lockstep.
+        If larger than 1, the policy is called once per step with observations of all environments,
+        so pol should accept batched observations.
+    fragment_length : int or None
+        If not None, each process samples segments of at most fragment_length steps,
+        and exactly max_steps steps are sampled in total.
+        An unfinished episode is continued in the next sampling.
+        Segments have `truncated` and `last_ob` keys for bootstrapping
+        (see machina.traj.epi_functional.compute_advs).
+        Only envs_per_worker=1 is supported.
+    e_i_keys : list of str or None
+        Keys of env info which are stored in episodes.
+        If None, all keys are stored. Storing unused keys costs time for cheap environments.
+    dtypes : dict or None
+        dtypes of arrays in episodes for keys of episodes ('obs', 'acs', 'rews', 'dones')
+        and keys of a_is and e_is. e.g. `dict(obs='uint8')` for pixel observations.
+        Unspecified arrays are float32.
+        Smaller dtypes reduce memory and transfer, and Traj casts them to float in batches.
+    inference_server : bool
+        If True, pol is held only by an inference server process,
+        which computes actions for all processes with batched forward.
+        This is efficient for large networks.
+        Only envs_per_worker=1 is supported.
+    inference_max_wait : float
+        Maximum time in seconds for which the inference server waits to batch requests.
+    inference_num_threads : int
+        Number of threads of torch in the inference server.
+    backend : str
+        'process' or 'thread'.
+        With 'thread', num_parallel threads in this process sample with pol shared,
+        which avoids startup of processes and copies of episodes.
+        This is efficient for environments whose step releases the GIL.
+        prepro is also shared by threads.
+    num_threads : int or None
+        If not None, torch.set_num_threads(num_threads) is called with 'thread' backend.
+        Note that this also affects the other parts of this process.
+    autotune : bool
+        If True, each of the first samplings uses a different number of workers
+        (and envs_per_worker if autotune_envs_per_worker is given),
+        and the configuration with the highest steps/sec is used afterwards.
+        num_parallel is the maximum number of workers.
+        The chosen configuration is logged and kept in `autotuner.result`.
+    autotune_envs_per_worker : list of int or None
+        Candidates of envs_per_worker. If None, envs_per_worker is not tuned.
+    reserved_cpus : int
+        Number of CPUs reserved for training, which autotune does not use for workers.
+    optimize_pol : bool
+        If True, workers compute actions by InferencePol,
+        which runs the net of pol and sampling of its distribution traced by TorchScript
+        under torch.inference_mode. This is not supported with inference_server.
+    nice : int
+        Niceness added to sampling processes. Positive values lower their priority,
+        so that they do not slow down training. This is ignored with 'thread' backend.
+    core_budget : CoreBudget or None
+        If given, each sampling process is pinned to a core of `core_budget.worker_cpus`,
+        and autotune does not use more workers than these cores.
+        The learner should call `core_budget.pin_learner()`.
+        This is ignored with 'thread' backend.
+    record_dir : str or None
+        If given, each worker appends sampled episodes to its own shard in record_dir,
+        which is read by machina.samplers.epi_dataset.iterate_epis or load_traj.
+        Episodes of existing shards are kept.
     """
 
-    def __init__(self, env, pol, num_parallel=8, prepro=None, seed=256):
+    def __init__(self, env, pol, num_parallel=8, prepro=None, seed=256, envs_per_worker=1, fragment_length=None, e_i_keys=None, dtypes=None,
+                 inference_server=False, inference_max_wait=1e-3, inference_num_threads=1, backend='process', num_threads=None,
+                 autotune=False, autotune_envs_per_worker=None, reserved_cpus=1, optimize_pol=False, nice=0, core_budget=None, record_dir=None):
+        if backend not in ('process', 'thread'):
+            raise ValueError('backend should be process or thread')
+        if inference_server and optimize_pol:
+            raise ValueError(
+                'optimize_pol is not supported with inference_server')
+        if backend == 'thread' and inference_server:
+            raise ValueError(
+                'inference_server is not supported with thread backend')
+        if autotune_envs_per_worker is None:
+            autotune_envs_per_worker = [envs_per_worker]
+        if (fragment_length is not None or inference_server) and max([envs_per_worker] + list(autotune_envs_per_worker)) > 1:
+            raise ValueError(
+                'fragment_length and inference_server are not supported with envs_per_worker > 1')
         self.env = env
         self.pol = copy.deepcopy(pol)
         self.pol.to('cpu')
-        self.pol.share_memory()
         self.pol.eval()
+        self.shared_params = SharedParams(self.pol)
         self.num_parallel = num_parallel
+        self.envs_per_worker = envs_per_worker
+        self.fragment_length = fragment_length
+        self.backend = backend
+        self.optimize_pol = optimize_pol
+        self.nice = nice
+        self.core_budget = core_budget
+        self.num_active = num_parallel
+        if autotune:
+            max_workers = num_parallel if core_budget is None else min(
+                num_parallel, len(core_budget.worker_cpus))
+            self.autotuner = Autotuner(
+                max_workers, autotune_envs_per_worker, reserved_cpus)
+            self.tuning = (None, None)
+        else:
+            self.autotuner = None
 
         self.n_steps_global = torch.tensor(0, dtype=torch.long).share_memory_()
         self.max_steps = torch.tensor(0, dtype=torch.long).share_memory_()
         self.n_epis_global = torch.tensor(
             0, dtype=torch.long).share_memory_()
         self.max_epis = torch.tensor(0, dtype=torch.long).share_memory_()
+        self.lock = mp.Lock() if backend == 'process' else threading.Lock()
 
-        self.exec_flags = [torch.tensor(
-            0, dtype=torch.long).share_memory_() for _ in range(self.num_parallel)]
+        self.exec_events = [mp.Event() for _ in range(self.num_parallel)]
         self.deterministic_flag = torch.tensor(
             0, dtype=torch.uint8).share_memory_()
+        self.stream_flag = torch.tensor(0, dtype=torch.uint8).share_memory_()
+        self.stats_values = make_stats_values(self.num_parallel)
 
-        self.epis = mp.Manager().list()
-        self.processes = []
+        self.prepro = prepro
+        self.seed = seed
+        self.e_i_keys = e_i_keys
+        self.dtypes = dtypes
+        self.record_dir = record_dir
+        self.future = None
+
+        if backend == 'thread':
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            self.counter = SampleCounter(self.n_steps_global, self.max_steps,
+                                         self.n_epis_global, self.max_epis, self.lock)
+            # Shallow copies share parameters, and keep hidden states of rnn separately.
+            self.worker_pols = [copy.copy(self.pol)
+                                for _ in range(self.num_parallel)]
+            if optimize_pol:
+                self.worker_pols = [InferencePol(pol)
+                                    for pol in self.worker_pols]
+            self._make_worker_envs()
+            self.fragment_states = [dict() for _ in range(self.num_parallel)]
+            # Each thread reuses its buffer, and episodes are copied out of it.
+            self.rollout_buffers = [RolloutBuffer(self.pol.action_space.shape, self.pol.a_i_shape, capacity=epi_capacity(self.env),
+                                                  e_i_keys=e_i_keys, dtypes=dtypes) for _ in range(self.num_parallel)]
+            self.epi_writers = [EpiShardWriter(os.path.join(record_dir, 'shard_{}'.format(ind))) if record_dir is not None else None
+                                for ind in range(self.num_parallel)]
+            self.executor = ThreadPoolExecutor(self.num_parallel)
+            return
+
+        self.inference_server = inference_server
+        self.inference_max_wait = inference_max_wait
+        self.inference_num_threads = inference_num_threads
+        self.server_process = None
+        if inference_server:
+            self.inference_buffers = make_inference_buffers(
+                self.pol, self.num_parallel)
+            self._start_inference_server()
+
+        self.conns = [None] * self.num_parallel
+        self.epi_buffers = [[None, None] for _ in range(self.num_parallel)]
+        self.processes = [None] * self.num_parallel
         for ind in range(self.num_parallel):
-            p = mp.Process(target=mp_sample, args=(self.pol, env, self.max_steps, self.max_epis, self.n_steps_global,
-                                                   self.n_epis_global, self.epis, self.exec_flags[ind], self.deterministic_flag, ind, prepro, seed))
-            p.start()
-            self.processes.append(p)
+            self._start_worker(ind)
+
+    def _make_worker_envs(self):
+        K = self.envs_per_worker
+        self.worker_envs = [make_envs(self.env, K, self.seed + ind * K)
+                            for ind in range(self.num_parallel)]
+        if K == 1:
+            self.worker_envs = [envs[0] for envs in self.worker_envs]
+
+    def _set_config(self, num_workers, envs_per_worker):
+        """
+        Changing the number of workers which sample, and envs_per_worker.
+        Workers are restarted if envs_per_worker is changed.
+        """
+        self.num_active = num_workers
+        if envs_per_worker == self.envs_per_worker:
+            return
+        self.envs_per_worker = envs_per_worker
+        if self.backend == 'thread':
+            self._make_worker_envs()
+        else:
+            for ind in range(self.num_parallel):
+                self._start_worker(ind)
+
+    def _autotune(self):
+        """
+        Reporting the throughput of the previous sampling to autotuner, and setting the next configuration.
+        Throughput is computed from sample_time of workers, so that it does not include time of training.
+        """
+        config, snapshot = self.tuning
+        if config is not None:
+            delta = (self.stats_values - snapshot)[:config[0]]
+            self.autotuner.report(config, delta[:, STAT_KEYS.index('steps')].sum().item(),
+                                  delta[:, STAT_KEYS.index('sample_time')].max().item())
+        if self.autotuner.finished:
+            result = self.autotuner.result
+            self._set_config(result['num_workers'], result['envs_per_worker'])
+            self.tuning = None
+            return
+        config = self.autotuner.next_config()
+        self._set_config(*config)
+        self.tuning = (config, self.stats_values.clone())
+
+    def _start_inference_server(self):
+        if self.server_process is not None:
+            self.server_process.terminate()
+            self.server_process.join()
+        self.request_queue = mp.Queue()
+        # Events on which killed processes waited can not be used again.
+        self.response_events = [mp.Event() for _ in range(self.num_parallel)]
+        p = mp.Process(target=mp_inference, args=(self.pol, self.request_queue, self.inference_buffers, self.response_events,
+                                                  self.deterministic_flag, self.seed, self.inference_max_wait, self.inference_num_threads))
+        p.start()
+        self.server_process = p
+
+    def _start_worker(self, ind):
+        """
+        Starting a sampling process. If the process exists, it is terminated and started again.
+        """
+        if self.processes[ind] is not None:
+            self.processes[ind].terminate()
+            self.processes[ind].join()
+        if self.inference_server:
+            pol = InferenceClient(self.pol, ind, self.request_queue,
+                                  self.inference_buffers, self.response_events[ind])
+        elif self.optimize_pol:
+            pol = InferencePol(self.pol)
+        else:
+            pol = self.pol
+        # An event on which a killed process waited can not be used again.
+        self.exec_events[ind] = mp.Event()
+        self.epi_buffers[ind][:] = [None, None]
+        conn, child_conn = mp.Pipe()
+        p = mp.Process(target=mp_sample, args=(pol, self.env, self.max_steps, self.max_epis, self.n_steps_global,
+                                               self.n_epis_global, self.lock, child_conn, self.exec_events[ind], self.deterministic_flag, ind, self.prepro, self.seed, self.envs_per_worker, self.fragment_length, self.e_i_keys, self.stats_values[ind], self.shared_params.version, self.dtypes, self.stream_flag, self.core_budget, self.record_dir))
+        p.start()
+        if self.nice != 0:
+            os.setpriority(os.PRIO_PROCESS, p.pid, os.getpriority(
+                os.PRIO_PROCESS, 0) + self.nice)
+        self.conns[ind] = conn
+        self.processes[ind] = p
+
+    def _respawn(self, ind):
+        """
+        Restarting a dead or stuck sampling process with its env and seed.
+        With the inference server, it and all sampling processes are restarted,
+        because the inference server may wait on the killed process.
+
+        Returns
+        -------
+        inds : list of int
+            Indices of restarted sampling processes.
+        """
+        if self.inference_server:
+            logger.log(
+                'Restarting inference server and all sampling processes.')
+            self._start_inference_server()
+            for i in range(self.num_parallel):
+                self._start_worker(i)
+            return list(range(self.num_parallel))
+        logger.log('Restarting sampling process {}.'.format(ind))
+        self._start_worker(ind)
+        return [ind]
+
+    def close(self):
+        """
+        Terminating all processes.
+        """
+        # Attributes may not be set if __init__ raised.
+        if getattr(self, 'backend', None) == 'thread':
+            if hasattr(self, 'executor'):
+                self.executor.shutdown(wait=False)
+            return
+        for p in getattr(self, 'processes', []) + [getattr(self, 'server_process', None)]:
+            if p is not None:
+                p.terminate()
+                p.join()
+        self.processes = []
+        self.server_process = None
 
     def __del__(self):
-        for p in self.processes:
-            p.terminate()
+        self.close()
+
+    def stats(self, record=False, reset=False):
+        """
+        Counters of each worker accumulated over samplings.
+        Counters are updated when each worker finishes sampling.
+        pol_time includes communication with the inference server if it is used.
+
+        Parameters
+        ----------
+        record : bool
+            If True, sums over workers are recorded by logger.record_tabular.
+        reset : bool
+            If True, counters are reset to 0. This should not be called during sampling.
+
+        Returns
+        -------
+        stats : list of dict
+            env_time, pol_time, prepro_time, sample_time and idle_time in seconds,
+            steps, epis and steps_per_sec of each worker.
+        """
+        stats = stats_to_dicts(self.stats_values)
+        if record:
+            record_stats(stats)
+        if reset:
+            self.stats_values.zero_()
+        return stats
 
-    def sample(self, pol, max_epis=None, max_steps=None, deterministic=False):
+    def sample(self, pol, max_epis=None, max_steps=None, deterministic=False, timeout=None):
         """
-        Switch on sampling processes.
+        Switch on sampling processes and wait for them.
 
         Parameters
         ----------
@@ -189,23 +1264,155 @@ class EpiSampler(object):
             maximum steps of episodes
             If None, this value is ignored.
         deterministic : bool
+        timeout : float or None
+            Seconds to wait for workers. See `SampleFuture.result`.
 
         Returns
         -------
         epis : list of dict
             Sampled epis.
+            With process backend, arrays in epis are views of shared memory,
+            which are overwritten by the sampling after next.
+            If some workers failed, only epis of the other workers are returned.
 
         Raises
         ------
         ValueError
             If max_steps and max_epis are botch None.
         """
-        for sp, p in zip(self.pol.parameters(), pol.parameters()):
-            sp.data.copy_(p.data.to('cpu'))
+        return self.sample_async(pol, max_epis, max_steps, deterministic).result(timeout)
+
+    def sample_population(self, pols, max_epis=None, max_steps=None, deterministic=False, timeout=None):
+        """
+        Sampling with several policies by the workers of this sampler.
+        Policies are sampled in turn with all workers,
+        and parameters of workers are switched to each policy by one copy.
+        So several small experiments share processes and environments of one sampler.
+
+        Parameters
+        ----------
+        pols : dict of Pol
+            Policies whose structure is the same as pol of this sampler.
+        max_epis : int or dict or None
+            maximum episodes of episodes for each policy.
+            If dict, the value for the name of each policy is used.
+        max_steps : int or dict or None
+            maximum steps of episodes for each policy.
+            If dict, the value for the name of each policy is used.
+        deterministic : bool
+        timeout : float or None
+            Seconds to wait for workers in each sampling.
+
+        Returns
+        -------
+        epis : dict of list of dict
+            Sampled epis for each name of pols.
+            The name is also set to `epi['pol_name']`.
+            Arrays in epis are copied, so they are not overwritten by later samplings.
+
+        Raises
+        ------
+        ValueError
+            If fragment_length is not None, because unfinished episodes can not be continued by another policy.
+        """
+        if self.fragment_length is not None:
+            raise ValueError(
+                'sample_population is not supported with fragment_length')
+
+        def budget(value, name):
+            return value.get(name) if isinstance(value, dict) else value
+
+        population_epis = dict()
+        for name, pol in pols.items():
+            epis = self.sample(pol, budget(max_epis, name), budget(
+                max_steps, name), deterministic, timeout)
+            if self.backend == 'process':
+                epis = copy.deepcopy(epis)
+            for epi in epis:
+                epi['pol_name'] = name
+            population_epis[name] = epis
+        return population_epis
+
+    def stream(self, pol, max_epis=None, max_steps=None, deterministic=False, timeout=None):
+        """
+        Switch on sampling processes, and yield epis as soon as they are finished.
+        Epis can be processed while the other epis are sampled.
+        The next sampling can be started after all epis are yielded.
 
+        Parameters
+        ----------
+        pol : Pol
+        max_epis : int or None
+            maximum episodes of episodes.
+            If None, this value is ignored.
+        max_steps : int or None
+            maximum steps of episodes
+            If None, this value is ignored.
+        deterministic : bool
+        timeout : float or None
+            Seconds to wait for workers. See `SampleFuture.result`.
+
+        Returns
+        -------
+        epis : generator of dict
+            With process backend, arrays in epis are views of shared memory,
+            which are overwritten by the sampling after next.
+
+        Raises
+        ------
+        ValueError
+            See `sample_async`.
+        """
+        return self.sample_async(pol, max_epis, max_steps, deterministic, stream=True).stream(timeout)
+
+    def sample_async(self, pol, max_epis=None, max_steps=None, deterministic=False, stream=False):
+        """
+        Switch on sampling processes without waiting for them.
+        Parameters and buffers of pol are copied to shared memory by one copy when this method is called,
+        so pol can be trained while sampling.
+        The version of the copied parameters is recorded in `epi['pol_version']`,
+        and the current version is `self.shared_params.version`.
+        Only one sampling runs at a time. Episodes are therefore sampled
+        with weights at most one call of this method older than the current weights.
+
+        Parameters
+        ----------
+        pol : Pol
+        max_epis : int or None
+            maximum episodes of episodes.
+            If None, this value is ignored.
+        max_steps : int or None
+            maximum steps of episodes
+            If None, this value is ignored.
+        deterministic : bool
+        stream : bool
+            If True, processes send each episode as soon as it is finished,
+            and `future.stream()` yields it.
+
+        Returns
+        -------
+        future : SampleFuture or ThreadSampleFuture
+            `future.result()` returns sampled epis.
+
+        Raises
+        ------
+        ValueError
+            If max_steps and max_epis are botch None,
+            max_steps is None with fragment_length,
+            or the previous sampling has not been received by `result()`.
+        """
         if max_epis is None and max_steps is None:
             raise ValueError(
                 'Either max_epis or max_steps needs not to be None')
+        if self.fragment_length is not None and max_steps is None:
+            raise ValueError(
+                'max_steps needs not to be None with fragment_length')
+        if self.future is not None and self.future.epis is None:
+            raise ValueError(
+                'Previous sampling is not finished. Call result() of its future first.')
+
+        self.shared_params.load(pol)
+
         max_epis = max_epis if max_epis is not None else LARGE_NUMBER
         max_steps = max_steps if max_steps is not None else LARGE_NUMBER
 
@@ -222,12 +1429,29 @@ class EpiSampler(object):
             self.deterministic_flag += 1
         else:
             self.deterministic_flag.zero_()
+        self.stream_flag.fill_(int(stream))
+
+        if self.autotuner is not None and self.tuning is not None:
+            self._autotune()
+
+        if self.backend == 'thread':
+            epi_queue = queue.Queue()
+            futures = [self.executor.submit(_put_epis, worker_epis(self.worker_pols[ind], self.worker_envs[ind], self.counter, deterministic, self.prepro,
+                                                                   self.fragment_length, self.fragment_states[
+                ind], self.rollout_buffers[ind], self.e_i_keys,
+                WorkerStats(self.stats_values[ind]), self.shared_params.version, self.dtypes, copy_epis=True), epi_queue, self.epi_writers[ind])
+                for ind in range(self.num_active)]
+            self.future = ThreadSampleFuture(futures, self.counter, epi_queue)
+            return self.future
 
-        del self.epis[:]
+        for ind, p in enumerate(self.processes):
+            if not p.is_alive():
+                self._respawn(ind)
 
-        for exec_flag in self.exec_flags:
-            exec_flag += 1
+        inds = list(range(self.num_active))
+        for ind in inds:
+            self.exec_events[ind].set()
 
-        while True:
-            if all([exec_flag == 0 for exec_flag in self.exec_flags]):
-                return list(self.epis)
+        self.future = SampleFuture(self.conns, self.epi_buffers, self.processes,
+                                   weakref.WeakMethod(self._respawn), inds)
+        return self.future
@@ -0,0 +1,105 @@
+"""
+Sampler which evaluates snapshots of a policy in the background.
+"""
+
+import copy
+import queue
+import threading
+
+import numpy as np
+
+from machina import logger
+from machina.samplers.epi_sampler import EpiSampler
+from machina.utils import get_cpu_state_dict
+
+
+class EvalSampler(object):
+    """
+    Sampler which runs deterministic episodes of snapshots of a policy
+    with a small pool of low priority processes, while training continues.
+    Snapshots are evaluated in order by a background thread,
+    and their returns are logged with the training step of the snapshot.
+
+    Parameters
+    ----------
+    env : gym.Env
+    pol : Pol
+    num_parallel : int
+        Number of processes for evaluation.
+    num_epis : int
+        Number of episodes for each evaluation.
+    prepro : Prepro
+    seed : int
+    nice : int
+        Niceness added to processes for evaluation.
+    """
+
+    def __init__(self, env, pol, num_parallel=1, num_epis=10, prepro=None, seed=256, nice=10):
+        self.sampler = EpiSampler(env, pol, num_parallel=num_parallel,
+                                  prepro=prepro, seed=seed, nice=nice)
+        self.pol = copy.deepcopy(pol)
+        self.pol.to('cpu')
+        self.num_epis = num_epis
+        self.results = []
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def evaluate(self, pol, step):
+        """
+        Taking a snapshot of pol, which is evaluated later.
+        This method does not wait for the evaluation.
+
+        Parameters
+        ----------
+        pol : Pol
+        step : int
+            Training step of the snapshot, e.g. total steps.
+        """
+        snapshot = copy.deepcopy(self.pol)
+        snapshot.load_state_dict(get_cpu_state_dict(pol))
+        self.queue.put((step, snapshot))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            step, snapshot = item
+            try:
+                epis = self.sampler.sample(
+                    snapshot, max_epis=self.num_epis, deterministic=True)
+                self._report(step, epis)
+            except Exception as e:
+                logger.log('Evaluation at step {} failed: {}'.format(step, e))
+            self.queue.task_done()
+
+    def _report(self, step, epis):
+        rewards = [np.sum(epi['rews']) for epi in epis]
+        result = dict(Step=step, EvalRewardAverage=np.mean(rewards), EvalRewardStd=np.std(rewards),
+                      EvalRewardMax=np.max(rewards), EvalRewardMin=np.min(rewards), EvalEpisode=len(epis))
+        self.results.append(result)
+        logger.log('Evaluation at step {}: EvalRewardAverage={:.3f} EvalRewardStd={:.3f} ({} episodes)'.format(
+            step, result['EvalRewardAverage'], result['EvalRewardStd'], len(epis)))
+
+    def wait(self):
+        """
+        Waiting for all evaluations of taken snapshots.
+
+        Returns
+        -------
+        results : list of dict
+            Results of evaluations in order of steps.
+        """
+        self.queue.join()
+        return self.results
+
+    def close(self):
+        """
+        Finishing evaluations of taken snapshots, and stopping processes.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.sampler.close()
@@ -0,0 +1,126 @@
+"""
+Policy wrapper optimized for sampling.
+"""
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from machina.pols import CategoricalPol, GaussianPol, MultiCategoricalPol
+from machina.samplers.rollout_buffer import _to_numpy
+from machina.utils import cpu_mode
+
+
+_inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+class _GaussianStep(nn.Module):
+    def __init__(self, pol, deterministic):
+        nn.Module.__init__(self)
+        self.net = pol.net
+        self.deterministic = deterministic
+        self.normalize_ac = pol.normalize_ac
+        self.register_buffer('lb', torch.tensor(pol.action_space.low))
+        self.register_buffer('ub', torch.tensor(pol.action_space.high))
+
+    def forward(self, obs):
+        mean, log_std = self.net(obs)
+        log_std = log_std.expand_as(mean)
+        if self.deterministic:
+            ac = mean
+        else:
+            ac = mean + torch.randn_like(mean) * torch.exp(log_std)
+        ac_real = ac
+        if self.normalize_ac:
+            ac_real = self.lb + (ac_real + 1.) * 0.5 * (self.ub - self.lb)
+        ac_real = torch.max(torch.min(ac_real, self.ub), self.lb)
+        return ac_real, ac, mean, log_std
+
+
+class _CategoricalStep(nn.Module):
+    def __init__(self, pol, deterministic):
+        nn.Module.__init__(self)
+        self.net = pol.net
+        self.deterministic = deterministic
+
+    def forward(self, obs):
+        pi = self.net(obs)
+        if self.deterministic:
+            ac = torch.argmax(pi, dim=-1)
+        else:
+            ac = torch.multinomial(
+                pi.reshape(-1, pi.shape[-1]), 1).reshape(pi.shape[:-1])
+        return ac, ac, pi
+
+
+class InferencePol(object):
+    """
+    Policy-like object which computes actions of pol with low overhead.
+    The net of pol and sampling of its distribution are fused into one module,
+    which is traced by TorchScript for each shape of observations.
+    The module runs under torch.inference_mode, and returned values are ndarray.
+    Parameters of the module are those of pol, so updates of pol are reflected.
+    Recurrent policies and other policies are called as they are under torch.inference_mode.
+
+    Parameters
+    ----------
+    pol : Pol
+    jit : bool
+        If True, the fused module is traced by TorchScript.
+    """
+
+    def __init__(self, pol, jit=True):
+        self.pol = pol
+        self.observation_space = pol.observation_space
+        self.action_space = pol.action_space
+        self.a_i_shape = pol.a_i_shape
+        self.rnn = pol.rnn
+        self.jit = jit
+        self.fused = not pol.rnn and isinstance(
+            pol, (GaussianPol, CategoricalPol, MultiCategoricalPol))
+        self.steps = dict()
+
+    def reset(self):
+        self.pol.reset()
+
+    def _step(self, obs, deterministic):
+        key = (tuple(obs.shape), deterministic)
+        if key not in self.steps:
+            if isinstance(self.pol, GaussianPol):
+                step = _GaussianStep(self.pol, deterministic)
+            else:
+                step = _CategoricalStep(self.pol, deterministic)
+            if self.jit:
+                # outputs of random sampling can not be checked
+                step = torch.jit.trace(step, obs, check_trace=False)
+            self.steps[key] = step
+        return self.steps[key]
+
+    def _call(self, obs, deterministic, kwargs):
+        obs = torch.as_tensor(obs, dtype=torch.float)
+        with cpu_mode(), _inference_mode():
+            if not self.fused:
+                if deterministic:
+                    ac_real, ac, a_i = self.pol.deterministic_ac_real(
+                        obs, **kwargs)
+                else:
+                    ac_real, ac, a_i = self.pol(obs, **kwargs)
+                a_i = dict([(key, value if value is None else tuple([_to_numpy(h) for h in value])
+                             if isinstance(value, tuple) else _to_numpy(value)) for key, value in a_i.items()])
+                return np.asarray(ac_real), _to_numpy(ac), a_i
+            if obs.dim() == len(self.observation_space.shape):
+                obs = obs.unsqueeze(0)
+            outs = [out.numpy() for out in self._step(obs, deterministic)(obs)]
+        if isinstance(self.pol, GaussianPol):
+            a_i = dict(mean=outs[2], log_std=outs[3], hs=None)
+        elif isinstance(self.pol, MultiCategoricalPol):
+            a_i = dict(pis=outs[2], hs=None)
+        else:
+            a_i = dict(pi=outs[2], hs=None)
+        return outs[0], outs[1], a_i
+
+    def __call__(self, obs, **kwargs):
+        return self._call(obs, False, kwargs)
+
+    def deterministic_ac_real(self, obs, **kwargs):
+        return self._call(obs, True, kwargs)
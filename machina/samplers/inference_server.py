@@ -0,0 +1,186 @@
+"""
+Inference server which computes actions for sampling processes.
+Sampling processes only step environments and send observations to
+the inference server through shared memory.
+The inference server batches requests from sampling processes,
+so a policy exists only in the inference server.
+"""
+
+import queue
+import time
+
+import numpy as np
+import torch
+
+from machina.utils import cpu_mode
+
+
+def make_inference_buffers(pol, num_workers):
+    """
+    Making shared tensors for communication between the inference server and sampling processes.
+    Shapes of outputs are determined by a forward of pol with a dummy observation.
+
+    Parameters
+    ----------
+    pol : Pol
+    num_workers : int
+
+    Returns
+    -------
+    buffers : dict
+    """
+    with cpu_mode(), torch.no_grad():
+        ob = torch.zeros(pol.observation_space.shape, dtype=torch.float)
+        ac_real, ac, a_i = pol(ob)
+        pol.reset()
+    ac_real = np.asarray(ac_real)
+    a_is = dict()
+    for key, value in a_i.items():
+        if value is None:
+            continue
+        if isinstance(value, tuple):
+            a_is[key] = tuple([torch.zeros((num_workers, ) + h.squeeze().shape).share_memory_()
+                               for h in value])
+        else:
+            a_is[key] = torch.zeros(
+                (num_workers, ) + pol.a_i_shape).share_memory_()
+    return dict(
+        obs=torch.zeros((num_workers, ) +
+                        pol.observation_space.shape).share_memory_(),
+        ac_real=torch.zeros((num_workers, ) + pol.action_space.shape,
+                            dtype=torch.from_numpy(ac_real).dtype).share_memory_(),
+        acs=torch.zeros((num_workers, ) +
+                        pol.action_space.shape).share_memory_(),
+        a_is=a_is,
+        reset_flags=torch.zeros(
+            num_workers, dtype=torch.uint8).share_memory_(),
+    )
+
+
+class InferenceClient(object):
+    """
+    Policy-like object used in a sampling process instead of Pol.
+    Observations are sent to the inference server, and actions are returned.
+    Returned tensors are views of shared memory, which are overwritten by the next call.
+
+    Parameters
+    ----------
+    pol : Pol
+        Pol which the inference server has.
+    worker_id : int
+    request_queue : multiprocessing.Queue
+    buffers : dict
+        Returned value of make_inference_buffers.
+    response_event : multiprocessing.Event
+        Set by the inference server when the action is written.
+    """
+
+    def __init__(self, pol, worker_id, request_queue, buffers, response_event):
+        self.observation_space = pol.observation_space
+        self.action_space = pol.action_space
+        self.a_i_shape = pol.a_i_shape
+        self.rnn = pol.rnn
+        self.worker_id = worker_id
+        self.request_queue = request_queue
+        self.buffers = buffers
+        self.response_event = response_event
+
+    def reset(self):
+        self.buffers['reset_flags'][self.worker_id] = 1
+
+    def __call__(self, ob):
+        i = self.worker_id
+        buffers = self.buffers
+        buffers['obs'][i] = torch.as_tensor(
+            ob, dtype=torch.float).reshape(buffers['obs'].shape[1:])
+        self.request_queue.put(i)
+        self.response_event.wait()
+        self.response_event.clear()
+        a_i = dict()
+        for key, value in buffers['a_is'].items():
+            if isinstance(value, tuple):
+                a_i[key] = tuple([h[i] for h in value])
+            else:
+                a_i[key] = value[i]
+        return buffers['ac_real'][i].numpy(), buffers['acs'][i], a_i
+
+    def deterministic_ac_real(self, ob):
+        """
+        Whether the action is deterministic is determined by deterministic_flag of the inference server.
+        """
+        return self(ob)
+
+
+def mp_inference(pol, request_queue, buffers, response_events, deterministic_flag, seed=256, max_wait=1e-3, num_threads=1):
+    """
+    Inference server.
+    Requests are batched until all sampling processes send requests or max_wait seconds pass.
+    Hidden states of rnn are kept for each sampling process.
+
+    Parameters
+    ----------
+    pol : Pol
+    request_queue : multiprocessing.Queue
+        Ids of sampling processes which wait for actions.
+    buffers : dict
+        Returned value of make_inference_buffers.
+    response_events : list of multiprocessing.Event
+    deterministic_flag : torch.Tensor
+    seed : int
+    max_wait : float
+        Maximum time in seconds to wait for other requests after the first request.
+    num_threads : int
+        Number of threads of torch.
+    """
+
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    torch.set_num_threads(num_threads)
+
+    num_workers = len(response_events)
+    if pol.rnn:
+        hs_store = pol.net.init_hs(num_workers)
+
+    with cpu_mode(), torch.no_grad():
+        while True:
+            ids = [request_queue.get()]
+            deadline = time.time() + max_wait
+            while len(ids) < num_workers:
+                try:
+                    ids.append(request_queue.get(
+                        timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            index = torch.tensor(ids, dtype=torch.long)
+            batch_size = len(ids)
+
+            obs = buffers['obs'][index]
+            kwargs = dict()
+            if pol.rnn:
+                obs = obs.unsqueeze(0)
+                h_masks = buffers['reset_flags'][index].float().reshape(
+                    1, batch_size, 1)
+                buffers['reset_flags'][index] = 0
+                kwargs = dict(hs=tuple([h[index] for h in hs_store]),
+                              h_masks=h_masks)
+            if deterministic_flag:
+                ac_real, ac, a_i = pol.deterministic_ac_real(obs, **kwargs)
+            else:
+                ac_real, ac, a_i = pol(obs, **kwargs)
+            if pol.rnn:
+                for h_store, h in zip(hs_store, a_i['hs']):
+                    h_store[index] = h.reshape(h_store[index].shape)
+
+            ac_real = torch.from_numpy(np.asarray(ac_real))
+            buffers['ac_real'][index] = ac_real.reshape(
+                buffers['ac_real'][index].shape).to(buffers['ac_real'].dtype)
+            buffers['acs'][index] = ac.reshape(buffers['acs'][index].shape)
+            for key, value in buffers['a_is'].items():
+                if isinstance(value, tuple):
+                    for v, h in zip(value, a_i[key]):
+                        v[index] = h.reshape(v[index].shape)
+                else:
+                    value[index] = a_i[key].reshape(value[index].shape)
+
+            for i in ids:
+                response_events[i].set()
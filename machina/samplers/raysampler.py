@@ -43,7 +43,10 @@ import numpy as np
 import torch
 import torch.multiprocessing as mp
 
-from machina.utils import cpu_mode, init_ray, get_cpu_state_dict
+from machina.samplers.epi_sampler import one_epi
+from machina.samplers.rollout_buffer import RolloutBuffer
+from machina.samplers.sampler_stats import WorkerStats, make_stats_values, record_stats, stats_to_dicts
+from machina.utils import init_ray, get_cpu_state_dict
 from machina import logger
 
 
@@ -51,17 +54,22 @@ LARGE_NUMBER = 100000000
 
 
 class BaseSampleWorker(ABC):
-    def __init__(self, pol, env, seed, worker_id, prepro=None):
+    def __init__(self, pol, env, seed, worker_id, prepro=None, core_budget=None):
         self.set_pol(pol)
         self.env = env
         self.worker_id = worker_id
         np.random.seed(seed + worker_id)
         torch.manual_seed(seed + worker_id)
-        torch.set_num_threads(1)
+        if core_budget is not None:
+            core_budget.pin_worker(worker_id)
+        else:
+            torch.set_num_threads(1)
         if prepro is None:
             self.prepro = lambda x: x
         else:
             self.prepro = prepro
+        self.stats_values = make_stats_values(1)
+        self.worker_stats = WorkerStats(self.stats_values[0])
 
     def set_pol(self, pol):
         self.pol = pol
@@ -70,6 +78,18 @@ class BaseSampleWorker(ABC):
     def set_pol_state(self, state_dict):
         self.pol.load_state_dict(state_dict)
 
+    def stats(self, reset=False):
+        """
+        Returns
+        -------
+        stats : dict
+            Counters of this worker. See machina.samplers.sampler_stats.
+        """
+        stats = stats_to_dicts(self.stats_values)[0]
+        if reset:
+            self.stats_values.zero_()
+        return stats
+
     @classmethod
     def as_remote(cls, resources=None):
         # It seems ray actor requires num_cpus=1 implicitly when requiring
@@ -93,65 +113,21 @@ class BaseSampleWorker(ABC):
 
 
 class DefaultSampleWorker(BaseSampleWorker):
-    def __init__(self, pol, env, seed, worker_id, prepro=None):
+    def __init__(self, pol, env, seed, worker_id, prepro=None, e_i_keys=None, dtypes=None, core_budget=None):
         super(DefaultSampleWorker, self).__init__(
-            pol, env, seed, worker_id, prepro)
+            pol, env, seed, worker_id, prepro, core_budget)
+        self.rollout_buffer = RolloutBuffer(
+            self.pol.action_space.shape, self.pol.a_i_shape, e_i_keys=e_i_keys, dtypes=dtypes)
 
     def one_epi(self, deterministic=False):
-        with cpu_mode():
-            obs = []
-            acs = []
-            rews = []
-            dones = []
-            a_is = []
-            e_is = []
-            o = self.env.reset()
-            self.pol.reset()
-            done = False
-            epi_length = 0
-            while not done:
-                o = self.prepro(o)
-                if not deterministic:
-                    ac_real, ac, a_i = self.pol(
-                        torch.tensor(o, dtype=torch.float))
-                else:
-                    ac_real, ac, a_i = self.pol.deterministic_ac_real(
-                        torch.tensor(o, dtype=torch.float))
-                ac_real = ac_real.reshape(self.pol.action_space.shape)
-                next_o, r, done, e_i = self.env.step(np.array(ac_real))
-                obs.append(o)
-                rews.append(r)
-                dones.append(done)
-                acs.append(ac.squeeze().detach().cpu(
-                ).numpy().reshape(self.pol.action_space.shape))
-                _a_i = dict()
-                for key in a_i.keys():
-                    if a_i[key] is None:
-                        continue
-                    if isinstance(a_i[key], tuple):
-                        _a_i[key] = tuple([h.squeeze().detach().cpu().numpy()
-                                           for h in a_i[key]])
-                    else:
-                        _a_i[key] = a_i[key].squeeze().detach(
-                        ).cpu().numpy().reshape(self.pol.a_i_shape)
-                a_i = _a_i
-                a_is.append(a_i)
-                e_is.append(e_i)
-                epi_length += 1
-                if done:
-                    break
-                o = next_o
-
-            return epi_length, dict(
-                obs=np.array(obs, dtype='float32'),
-                acs=np.array(acs, dtype='float32'),
-                rews=np.array(rews, dtype='float32'),
-                dones=np.array(dones, dtype='float32'),
-                a_is=dict([(key, np.array([a_i[key] for a_i in a_is], dtype='float32'))
-                           for key in a_is[0].keys()]),
-                e_is=dict([(key, np.array([e_i[key] for e_i in e_is], dtype='float32'))
-                           for key in e_is[0].keys()])
-            )
+        start = time.perf_counter()
+        # arrays of epi are views of rollout_buffer,
+        # which are copied when they are returned by ray.
+        epi_length, epi = one_epi(self.env, self.pol, deterministic,
+                                  self.prepro, self.rollout_buffer, self.worker_stats)
+        self.worker_stats.sample_time += time.perf_counter() - start
+        self.worker_stats.flush()
+        return epi_length, epi
 
 
 class EpiSampler(object):
@@ -179,10 +155,23 @@ class EpiSampler(object):
         10 workers require resources "node1" and 10 workers requires resource "node2".
         As a result, 10 workers scheduled on node 1 and 10 workers on node 2.
         Default (empty node_info) is using ray scheduling policy.
+    e_i_keys : list of str or None
+        Keys of env info which are stored in episodes.
+        If None, all keys are stored.
+        This is passed to worker_cls only if it is not None.
+    dtypes : dict or None
+        dtypes of arrays in episodes for keys of episodes ('obs', 'acs', 'rews', 'dones')
+        and keys of a_is and e_is. e.g. `dict(obs='uint8')`.
+        Unspecified arrays are float32.
+        This is passed to worker_cls only if it is not None.
+    core_budget : CoreBudget or None
+        If given, each worker is pinned to a core of `core_budget.worker_cpus`.
+        Cores are resolved on the machine where the budget is made.
+        This is passed to worker_cls only if it is not None.
     """
 
     def __init__(self, env, pol, num_parallel=8, prepro=None, seed=256,
-                 worker_cls=None, node_info={}):
+                 worker_cls=None, node_info={}, e_i_keys=None, dtypes=None, core_budget=None):
         if not ray.is_initialized():
             logger.log(
                 "Ray is not initialized. Initialize ray with no GPU resources")
@@ -206,7 +195,12 @@ class EpiSampler(object):
         if worker_cls is None:
             worker_cls = DefaultSampleWorker
 
-        self.workers = [worker_cls.as_remote(resources=r).remote(pol, env, seed, i, prepro)
+        kwargs = dict(e_i_keys=e_i_keys) if e_i_keys is not None else dict()
+        if dtypes is not None:
+            kwargs['dtypes'] = dtypes
+        if core_budget is not None:
+            kwargs['core_budget'] = core_budget
+        self.workers = [worker_cls.as_remote(resources=r).remote(pol, env, seed, i, prepro, **kwargs)
                         for i, r in zip(range(num_parallel), resources)]
 
     def set_pol(self, pol):
@@ -221,6 +215,27 @@ class EpiSampler(object):
         for w in self.workers:
             w.set_pol_state.remote(state_dict)
 
+    def stats(self, record=False, reset=False):
+        """
+        Counters of each worker accumulated over samplings.
+        idle_time is not measured.
+
+        Parameters
+        ----------
+        record : bool
+            If True, sums over workers are recorded by logger.record_tabular.
+        reset : bool
+            If True, counters are reset to 0.
+
+        Returns
+        -------
+        stats : list of dict
+        """
+        stats = ray.get([w.stats.remote(reset) for w in self.workers])
+        if record:
+            record_stats(stats)
+        return stats
+
     def sample(self, pol=None, max_epis=None, max_steps=None, deterministic=False):
         """
         Switch on sampling processes.
@@ -243,6 +258,22 @@ class EpiSampler(object):
         epis : list of dict
             Sampled epis.
 
+        Raises
+        ------
+        ValueError
+            If max_steps and max_epis are botch None.
+        """
+        return list(self.stream(pol, max_epis, max_steps, deterministic))
+
+    def stream(self, pol=None, max_epis=None, max_steps=None, deterministic=False):
+        """
+        Switch on sampling processes, and yield epis as soon as they are finished.
+        Parameters are the same as `sample()`.
+
+        Returns
+        -------
+        epis : generator of dict
+
         Raises
         ------
         ValueError
@@ -258,7 +289,9 @@ class EpiSampler(object):
         max_epis = max_epis if max_epis is not None else LARGE_NUMBER
         max_steps = max_steps if max_steps is not None else LARGE_NUMBER
 
-        epis = []
+        return self._stream(max_epis, max_steps, deterministic)
+
+    def _stream(self, max_epis, max_steps, deterministic):
         n_steps = 0
         n_epis = 0
 
@@ -269,10 +302,8 @@ class EpiSampler(object):
             for obj_id in ready:
                 worker = pending.pop(obj_id)
                 (l, epi) = ray.get(obj_id)
-                epis.append(epi)
                 n_steps += l
                 n_epis += 1
                 if n_steps < max_steps and (n_epis + len(pending)) < max_epis:
                     pending[worker.one_epi.remote(deterministic)] = worker
-
-        return epis
+                yield epi
@@ -0,0 +1,169 @@
+"""
+Buffer for assembling an episode in a sampling process.
+"""
+
+import numpy as np
+import torch
+
+
+def _to_numpy(x):
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy()
+    return np.asarray(x)
+
+
+class RolloutBuffer(object):
+    """
+    Buffer to which steps of an episode are written in place.
+    Arrays are allocated at the first step, and reallocated with doubled size
+    when an episode does not fit into them.
+    Arrays of `epi()` are views of the buffer, which are valid until `reset()`.
+
+    Parameters
+    ----------
+    action_shape : tuple
+        Shape of an action. e.g. `pol.action_space.shape`
+    a_i_shape : tuple
+        Shape of an action info. e.g. `pol.a_i_shape`
+    capacity : int
+        Initial number of steps which can be stored.
+    e_i_keys : list of str or None
+        Keys of env info which are stored.
+        If None, all keys of the first step are stored.
+    dtypes : dict or None
+        dtypes of arrays for keys of an episode ('obs', 'acs', 'rews', 'dones')
+        and keys of a_i and e_i. Unspecified arrays are float32.
+    """
+
+    def __init__(self, action_shape, a_i_shape, capacity=1000, e_i_keys=None, dtypes=None):
+        self.action_shape = tuple(action_shape)
+        self.a_i_shape = tuple(a_i_shape)
+        self.capacity = capacity
+        self.e_i_keys = e_i_keys
+        self.dtypes = dtypes if dtypes is not None else dict()
+        self.data_map = None
+        self.a_i_shapes = None
+        self.num_step = 0
+
+    def reset(self):
+        self.num_step = 0
+
+    def _allocate(self, capacity, o, r, a_i, e_i):
+        self.a_i_shapes = dict()
+        for key, value in a_i.items():
+            if value is None:
+                continue
+            if isinstance(value, tuple):
+                self.a_i_shapes[key] = tuple(
+                    [_to_numpy(h).squeeze().shape for h in value])
+            else:
+                self.a_i_shapes[key] = self.a_i_shape
+        if self.e_i_keys is None:
+            e_i_keys = list(e_i.keys())
+        else:
+            e_i_keys = [key for key in self.e_i_keys if key in e_i]
+
+        def dtype(key):
+            return self.dtypes.get(key, 'float32')
+
+        data_map = dict(
+            obs=np.zeros((capacity, ) + np.shape(o), dtype=dtype('obs')),
+            acs=np.zeros((capacity, ) + self.action_shape, dtype=dtype('acs')),
+            rews=np.zeros((capacity, ) + np.shape(r), dtype=dtype('rews')),
+            dones=np.zeros(capacity, dtype=dtype('dones')),
+            a_is=dict(),
+            e_is=dict(),
+        )
+        for key, shape in self.a_i_shapes.items():
+            if isinstance(a_i[key], tuple):
+                shape = (len(shape), ) + shape[0]
+            data_map['a_is'][key] = np.zeros(
+                (capacity, ) + shape, dtype=dtype(key))
+        for key in e_i_keys:
+            data_map['e_is'][key] = np.zeros(
+                (capacity, ) + np.shape(e_i[key]), dtype=dtype(key))
+        self.data_map = data_map
+        self.capacity = capacity
+
+    def _grow(self):
+        def grow(array):
+            new_array = np.zeros(
+                (2 * self.capacity, ) + array.shape[1:], dtype=array.dtype)
+            new_array[:self.num_step] = array[:self.num_step]
+            return new_array
+        for key, value in self.data_map.items():
+            if isinstance(value, dict):
+                for sub_key in value:
+                    value[sub_key] = grow(value[sub_key])
+            else:
+                self.data_map[key] = grow(value)
+        self.capacity *= 2
+
+    def _fits(self, a_i):
+        keys = [key for key, value in a_i.items() if value is not None]
+        return self.data_map is not None and set(keys) == set(self.a_i_shapes.keys())
+
+    def add(self, o, ac, r, done, a_i, e_i):
+        """
+        Writing a step.
+
+        Parameters
+        ----------
+        o : ndarray
+        ac : torch.Tensor or ndarray
+        r : float
+        done : bool
+        a_i : dict
+            Action info returned by pol. Tensors are written without conversion to dict of ndarray.
+        e_i : dict
+            Env info. Only keys in e_i_keys are written.
+        """
+        if self.num_step == 0 and not self._fits(a_i):
+            self._allocate(self.capacity, o, r, a_i, e_i)
+        elif self.num_step == self.capacity:
+            self._grow()
+        n = self.num_step
+        data_map = self.data_map
+        data_map['obs'][n] = o
+        data_map['acs'][n] = _to_numpy(ac).reshape(self.action_shape)
+        data_map['rews'][n] = r
+        data_map['dones'][n] = done
+        for key, shape in self.a_i_shapes.items():
+            value = a_i[key]
+            if isinstance(value, tuple):
+                for i, h in enumerate(value):
+                    data_map['a_is'][key][n, i] = _to_numpy(
+                        h).reshape(shape[i])
+            else:
+                data_map['a_is'][key][n] = _to_numpy(value).reshape(shape)
+        for key, value in data_map['e_is'].items():
+            value[n] = e_i[key]
+        self.num_step += 1
+
+    def epi(self, copy=False):
+        """
+        Episode which consists of written steps.
+
+        Parameters
+        ----------
+        copy : bool
+            If True, arrays are copies trimmed to the episode, which do not alias the buffer.
+
+        Returns
+        -------
+        epi : dict
+        """
+        n = self.num_step
+
+        def trim(array):
+            return array[:n].copy() if copy else array[:n]
+        return dict(
+            obs=trim(self.data_map['obs']),
+            acs=trim(self.data_map['acs']),
+            rews=trim(self.data_map['rews']),
+            dones=trim(self.data_map['dones']),
+            a_is=dict([(key, trim(value))
+                       for key, value in self.data_map['a_is'].items()]),
+            e_is=dict([(key, trim(value))
+                       for key, value in self.data_map['e_is'].items()]),
+        )
@@ -0,0 +1,94 @@
+"""
+Telemetry of sampling workers.
+"""
+
+import torch
+
+from machina import logger
+
+
+STAT_KEYS = ['env_time', 'pol_time', 'prepro_time',
+             'sample_time', 'idle_time', 'steps', 'epis']
+
+
+class WorkerStats(object):
+    """
+    Counters of a sampling worker.
+    Counters are accumulated in python floats for low overhead,
+    and added to `values` by `flush()`.
+
+    Parameters
+    ----------
+    values : torch.Tensor or None
+        Tensor of shape (len(STAT_KEYS), ) to which counters are flushed.
+        This can be a view of shared memory.
+    """
+
+    def __init__(self, values=None):
+        self.values = values
+        self.clear()
+
+    def clear(self):
+        for key in STAT_KEYS:
+            setattr(self, key, 0.)
+
+    def flush(self):
+        if self.values is not None:
+            self.values += torch.tensor([getattr(self, key)
+                                         for key in STAT_KEYS], dtype=self.values.dtype)
+        self.clear()
+
+
+def make_stats_values(num_workers):
+    """
+    Making a shared tensor which keeps counters of workers.
+
+    Parameters
+    ----------
+    num_workers : int
+
+    Returns
+    -------
+    values : torch.Tensor
+    """
+    return torch.zeros(num_workers, len(STAT_KEYS), dtype=torch.float64).share_memory_()
+
+
+def stats_to_dicts(values):
+    """
+    Converting counters of workers to dicts.
+    `steps_per_sec` is computed from `steps` and `sample_time`.
+
+    Parameters
+    ----------
+    values : torch.Tensor
+        Returned value of make_stats_values.
+
+    Returns
+    -------
+    stats : list of dict
+    """
+    stats = []
+    for row in values.tolist():
+        stat = dict(zip(STAT_KEYS, row))
+        stat['steps_per_sec'] = stat['steps'] / \
+            stat['sample_time'] if stat['sample_time'] > 0 else 0.
+        stats.append(stat)
+    return stats
+
+
+def record_stats(stats, prefix='Sampler'):
+    """
+    Recording counters summed over workers by logger.record_tabular.
+    `StepPerSec` is the sum of steps per second of workers.
+
+    Parameters
+    ----------
+    stats : list of dict
+        Returned value of stats_to_dicts.
+    prefix : str
+    """
+    for key, name in [('env_time', 'EnvTime'), ('pol_time', 'PolTime'), ('prepro_time', 'PreproTime'),
+                      ('sample_time', 'SampleTime'), ('idle_time', 'IdleTime'), ('steps_per_sec', 'StepPerSec')]:
+        logger.record_tabular(
+            prefix + name, sum([stat[key] for stat in stats]))
@@ -0,0 +1,110 @@
+"""
+Parameters of a policy in one flat shared tensor, which are synchronized with a version.
+"""
+
+import torch
+
+
+def _tensors(module):
+    return list(module.parameters()) + list(module.buffers())
+
+
+def flatten_params(module):
+    """
+    Parameters and buffers of a module in a flat tensor on cpu.
+    Tensors whose dtype is different from the first tensor are returned separately,
+    in the same way as SharedParams.
+
+    Parameters
+    ----------
+    module : torch.nn.Module
+
+    Returns
+    -------
+    flat : torch.Tensor
+    others : list of torch.Tensor
+    """
+    tensors = _tensors(module)
+    dtype = tensors[0].dtype if len(tensors) > 0 else torch.float
+    flat_tensors = [t for t in tensors if t.dtype == dtype]
+    with torch.no_grad():
+        flat = torch.cat([t.reshape(-1).to('cpu') for t in flat_tensors]) if len(
+            flat_tensors) > 0 else torch.zeros(0, dtype=dtype)
+        others = [t.detach().to('cpu') for t in tensors if t.dtype != dtype]
+    return flat, others
+
+
+def load_flat_params(module, flat, others):
+    """
+    Inverse of flatten_params. Parameters and buffers of module are overwritten in place.
+
+    Parameters
+    ----------
+    module : torch.nn.Module
+    flat : torch.Tensor
+        It is cast to the dtype of parameters.
+    others : list of torch.Tensor
+    """
+    tensors = _tensors(module)
+    dtype = tensors[0].dtype if len(tensors) > 0 else torch.float
+    offset = 0
+    with torch.no_grad():
+        for t in [t for t in tensors if t.dtype == dtype]:
+            n = t.numel()
+            t.copy_(flat[offset:offset + n].view_as(t))
+            offset += n
+        for t, other in zip([t for t in tensors if t.dtype != dtype], others):
+            t.copy_(other)
+
+
+class SharedParams(object):
+    """
+    Parameters and buffers of a module are replaced by views of a contiguous flat tensor in shared memory,
+    so that all processes which have the module are updated by one copy.
+    `version` is incremented every time the module is updated.
+    Buffers whose dtype is different from the flat tensor (e.g. counters of integer)
+    are shared but copied one by one.
+
+    Parameters
+    ----------
+    module : torch.nn.Module
+        Module on cpu. Its parameters and buffers are replaced in place.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        tensors = _tensors(module)
+        dtype = tensors[0].dtype if len(tensors) > 0 else torch.float
+        self.flat_tensors = [t for t in tensors if t.dtype == dtype]
+        self.other_tensors = [t for t in tensors if t.dtype != dtype]
+        self.flat = torch.zeros(sum([t.numel() for t in self.flat_tensors]),
+                                dtype=dtype).share_memory_()
+        offset = 0
+        for t in self.flat_tensors:
+            n = t.numel()
+            self.flat[offset:offset + n] = t.data.reshape(-1)
+            t.data = self.flat[offset:offset + n].view_as(t)
+            offset += n
+        for t in self.other_tensors:
+            t.share_memory_()
+        self.version = torch.tensor(0, dtype=torch.long).share_memory_()
+
+    def load(self, module):
+        """
+        Copying parameters and buffers of module, and incrementing version.
+
+        Parameters
+        ----------
+        module : torch.nn.Module
+            Module which has the same structure as the shared module. It can be on gpu.
+        """
+        tensors = _tensors(module)
+        flat_tensors = [t for t in tensors if t.dtype == self.flat.dtype]
+        other_tensors = [t for t in tensors if t.dtype != self.flat.dtype]
+        with torch.no_grad():
+            if len(flat_tensors) > 0:
+                self.flat.copy_(torch.cat([t.reshape(-1)
+                                           for t in flat_tensors]).to('cpu'))
+            for st, t in zip(self.other_tensors, other_tensors):
+                st.copy_(t.to('cpu'))
+        self.version += 1
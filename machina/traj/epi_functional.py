@@ -15,6 +15,7 @@ from machina.traj import Traj
 def compute_vs(data, vf):
     """
     Computing Value Function.
+    If an episode has `last_ob`, the value of it is also computed as `last_v`.
 
     Parameters
     ----------
@@ -40,7 +41,16 @@ def compute_vs(data, vf):
             else:
                 obs = torch.tensor(
                     epi['obs'], dtype=torch.float, device=get_device())
-            epi['vs'] = vf(obs)[0].detach().cpu().numpy()
+            if 'last_ob' in epi:
+                last_ob = torch.tensor(
+                    epi['last_ob'], dtype=torch.float, device=get_device())
+                last_ob = last_ob.reshape((1, ) + obs.shape[1:])
+                vs = vf(torch.cat([obs, last_ob], dim=0))[
+                    0].detach().cpu().numpy()
+                epi['vs'] = vs[:-1]
+                epi['last_v'] = vs[-1].item()
+            else:
+                epi['vs'] = vf(obs)[0].detach().cpu().numpy()
 
     return data
 
@@ -103,7 +113,8 @@ def compute_pris(data, qf, targ_qf, pol, gamma, continuous=True, deterministic=T
             data_map = dict()
             keys = ['obs', 'acs', 'rews', 'next_obs', 'dones']
             for key in keys:
-                data_map[key] = torch.tensor(epi[key], device=get_device())
+                data_map[key] = torch.tensor(
+                    epi[key], dtype=torch.float, device=get_device())
             if rnn:
                 qf.reset()
                 targ_qf.reset()
@@ -158,6 +169,8 @@ def compute_seq_pris(data, seq_length, eta=0.9):
 def compute_rets(data, gamma):
     """
     Computing discounted cumulative returns.
+    If an episode is truncated (e.g. a fragment sampled with fragment_length),
+    `last_v` computed by compute_vs is used for bootstrapping.
 
     Parameters
     ----------
@@ -178,7 +191,10 @@ def compute_rets(data, gamma):
     for epi in epis:
         rews = epi['rews']
         rets = np.empty(len(rews), dtype=np.float32)
-        last_rew = 0
+        if epi.get('truncated', False):
+            last_rew = epi['last_v']
+        else:
+            last_rew = 0
         for t in reversed(range(len(rews))):
             rets[t] = last_rew = rews[t] + gamma * last_rew
         epi['rets'] = rets
@@ -189,6 +205,8 @@ def compute_rets(data, gamma):
 def compute_advs(data, gamma, lam):
     """
     Computing Advantage Function.
+    If an episode is truncated (e.g. a fragment sampled with fragment_length),
+    `last_v` computed by compute_vs is used for bootstrapping.
 
     Parameters
     ----------
@@ -211,7 +229,10 @@ def compute_advs(data, gamma, lam):
     for epi in epis:
         rews = epi['rews']
         vs = epi['vs']
-        vs = np.append(vs, 0)
+        if epi.get('truncated', False):
+            vs = np.append(vs, epi['last_v'])
+        else:
+            vs = np.append(vs, 0)
         advs = np.empty(len(rews), dtype=np.float32)
         last_gaelam = 0
         for t in reversed(range(len(rews))):
@@ -389,7 +410,29 @@ def train_test_split(epis, train_size):
     return train_epis, test_epis
 
 
-def normalize_obs_and_acs(data, mean_obs=None, std_obs=None, mean_acs=None, std_acs=None, return_statistic=True, eps=1e-6):
+def normalize_obs_and_acs(data, mean_obs=None, std_obs=None, mean_acs=None, std_acs=None, return_statistic=True, eps=1e-6, ob_stats=None):
+    """
+    Normalizing obs, next_obs and acs of episodes.
+    Statistics which are None are computed from the episodes.
+
+    Parameters
+    ----------
+    data : Traj or list of dict
+    mean_obs, std_obs, mean_acs, std_acs : ndarray or None
+    return_statistic : bool
+        If True, statistics are also returned.
+    eps : float
+    ob_stats : RunningStats or None
+        If given, mean_obs and std_obs are taken from it,
+        so that observations are normalized consistently with samplers.
+
+    Returns
+    -------
+    data : Traj or list of dict
+    """
+    if ob_stats is not None:
+        _, mean_obs, var_obs = ob_stats.snapshot()
+        std_obs = np.sqrt(var_obs) + eps
     with torch.no_grad():
         if isinstance(data, Traj):
             epis = data.current_epis
@@ -14,6 +14,27 @@ from machina import loss_functional as lf
 from machina.utils import get_device
 
 LARGE_NUMBER = 1000000000000
+# keys of an episode which are not per step
+EPI_INFO_KEYS = ['truncated', 'last_ob', 'pol_version', 'last_v']
+# dtypes which are kept in Traj to save memory, and cast to float in batches
+COMPACT_DTYPES = [np.uint8, np.float16]
+
+
+def _to_tensor(array, device):
+    array = np.asarray(array)
+    if array.dtype in COMPACT_DTYPES:
+        return torch.tensor(array, device=device)
+    return torch.tensor(array, dtype=torch.float, device=device)
+
+
+def _to_batch(tensor):
+    """
+    Moving a tensor to the device for training, and casting a compact dtype to float there.
+    """
+    tensor = tensor.to(get_device())
+    if tensor.dtype in (torch.uint8, torch.float16):
+        tensor = tensor.float()
+    return tensor
 
 
 class Traj(object):
@@ -23,6 +44,8 @@ class Traj(object):
     An episode is a sequence of steps.
 
     This class provides batch methods.
+    Arrays of uint8 or float16 in episodes are kept in the dtype,
+    and cast to float on the device for training in batches.
 
     Parameters
     ----------
@@ -106,14 +129,16 @@ class Traj(object):
         keys = epis[0].keys()
         data_map = dict()
         for key in keys:
+            if key in EPI_INFO_KEYS:
+                continue
             if isinstance(epis[0][key], list) or isinstance(epis[0][key], np.ndarray):
-                data_map[key] = torch.tensor(np.concatenate(
-                    [epi[key] for epi in epis], axis=0), dtype=torch.float, device=self.traj_device())
+                data_map[key] = _to_tensor(np.concatenate(
+                    [epi[key] for epi in epis], axis=0), self.traj_device())
             elif isinstance(epis[0][key], dict):
                 new_keys = epis[0][key].keys()
                 for new_key in new_keys:
-                    data_map[new_key] = torch.tensor(np.concatenate(
-                        [epi[key][new_key] for epi in epis], axis=0), dtype=torch.float, device=self.traj_device())
+                    data_map[new_key] = _to_tensor(np.concatenate(
+                        [epi[key][new_key] for epi in epis], axis=0), self.traj_device())
 
         self._concat_data_map(data_map)
 
@@ -182,7 +207,7 @@ class Traj(object):
 
         data_map = dict()
         for key in self.data_map:
-            data_map[key] = self.data_map[key][indices].to(get_device())
+            data_map[key] = _to_batch(self.data_map[key][indices])
         return data_map
 
     def iterate_once(self, batch_size, indices=None, shuffle=True):
@@ -264,8 +289,7 @@ class Traj(object):
 
         data_map = dict()
         for key in self.data_map:
-            data_map[key] = self.data_map[key][indices].to(
-                get_device())
+            data_map[key] = _to_batch(self.data_map[key][indices])
         if return_indices:
             return data_map, indices
         else:
@@ -299,7 +323,7 @@ class Traj(object):
 
         data_map = dict()
         for key in self.data_map:
-            data_map[key] = self.data_map[key][indices].to(get_device())
+            data_map[key] = _to_batch(self.data_map[key][indices])
         if return_indices:
             return data_map, indices
         else:
@@ -332,7 +356,7 @@ class Traj(object):
         for key in keys:
             batch[key] = torch.stack([seq[key] for seq in seqs], dim=0)
             # (batch_size, seq_length, *) -> (seq_length, batch_size, *)
-            batch[key] = batch[key].transpose(0, 1).to(get_device())
+            batch[key] = _to_batch(batch[key].transpose(0, 1))
 
         if return_indices:
             return batch, start_indices
@@ -409,9 +433,10 @@ class Traj(object):
                         pad = torch.zeros_like(self.data_map[key][:seq_length-length],
                                                dtype=torch.float, device=get_device())
                         data_map[key] = torch.cat(
-                            [self.data_map[key][start: start+length], pad])
+                            [_to_batch(self.data_map[key][start: start+length]), pad])
                     else:
-                        data_map[key] = self.data_map[key][start: start+seq_length]
+                        data_map[key] = _to_batch(
+                            self.data_map[key][start: start+seq_length])
                 lengths.append(length)
                 seqs.append(data_map)
 
@@ -484,7 +509,7 @@ class Traj(object):
         """
         data_map = dict()
         for key in self.data_map:
-            data_map[key] = self.data_map[key].to(get_device())
+            data_map[key] = _to_batch(self.data_map[key])
         for _ in range(epoch):
             if return_indices:
                 yield data_map, torch.arange(self.num_step)
@@ -567,7 +592,7 @@ class Traj(object):
                 _batch = dict()
                 keys = batch[0].keys()
                 for key in keys:
-                    _batch[key] = pad_sequence(
-                        [b[key] for b in batch]).to(get_device())
+                    _batch[key] = _to_batch(pad_sequence(
+                        [b[key] for b in batch]))
                 _batch['out_masks'] = out_masks.to(get_device())
                 yield _batch
@@ -2,26 +2,81 @@
 These are functions which is applied to trajectory.
 """
 
-import time
-
-import cloudpickle
 import torch
 import torch.distributed as dist
 import numpy as np
 
 from machina import loss_functional as lf
-from machina.utils import get_device, get_redis, _int
+from machina.utils import decode_arrays, encode_arrays, get_device, get_redis
+
+
+def encode_traj(traj, compression=None):
+    """
+    Encoding data_map and episode boundaries of traj to bytes by machina.utils.encode_arrays.
+
+    Parameters
+    ----------
+    traj : Traj
+    compression : str or None
+        None, 'lz4' or 'zstd'.
+
+    Returns
+    -------
+    data : bytes
+    """
+    arrays = [('epis_index', np.asarray(traj._epis_index, dtype=np.int64))]
+    for key, value in traj.data_map.items():
+        arrays.append((['data_map', key], value.detach().cpu().numpy()))
+    meta = dict(max_steps=int(traj.max_steps))
+    if hasattr(traj, 'pri_beta'):
+        meta['pri_beta'] = float(traj.pri_beta)
+    return encode_arrays(arrays, meta, compression)
+
+
+def decode_traj(data, traj):
+    """
+    Inverse of encode_traj.
+    Arrays are decoded without copies on cpu, and moved to the device of traj.
+
+    Parameters
+    ----------
+    data : bytes
+    traj : Traj
+        Traj to which decoded values are set.
+
+    Returns
+    -------
+    traj : Traj
+    """
+    arrays, meta = decode_arrays(data, writable=True)
+    data_map = dict()
+    for key, value in arrays:
+        if key == 'epis_index':
+            traj._epis_index = value
+        else:
+            data_map[key[1]] = torch.from_numpy(
+                value).to(traj.traj_device())
+    traj.data_map = data_map
+    traj.current_epis = None
+    traj.max_steps = meta['max_steps']
+    if 'pri_beta' in meta:
+        traj.pri_beta = meta['pri_beta']
+    return traj
 
 
-def sync(traj, master_rank=0):
+def sync(traj, master_rank=0, compression=None):
     """
     Synchronize trajs. This function is used in multi node situation, and use redis.
+    master_rank pushes traj encoded by encode_traj to the list of each rank in one round trip,
+    and the other ranks block until it is pushed.
 
     Parameters
     ----------
     traj : Traj
     master_rank : int
         master_rank's traj is scattered
+    compression : str or None
+        None, 'lz4' or 'zstd'.
 
     Returns
     -------
@@ -30,28 +85,15 @@ def sync(traj, master_rank=0):
     rank = traj.rank
     r = get_redis()
     if rank == master_rank:
-        obj = cloudpickle.dumps(traj)
-        r.set('Traj', obj)
-        triggers = {'Traj_trigger' +
-                    "_{}".format(rank): '1' for rank in range(traj.world_size)}
-        triggers["Traj_trigger_{}".format(master_rank)] = '0'
-        r.mset(triggers)
-        while True:
-            time.sleep(0.1)
-            values = r.mget(triggers)
-            if all([_int(v) == 0 for v in values]):
-                break
+        obj = encode_traj(traj, compression)
+        pipe = r.pipeline(transaction=False)
+        for _rank in range(traj.world_size):
+            if _rank != master_rank:
+                pipe.rpush('Traj_{}'.format(_rank), obj)
+        pipe.execute()
     else:
-        while True:
-            time.sleep(0.1)
-            trigger = r.get('Traj_trigger' +
-                            "_{}".format(rank))
-            if _int(trigger) == 1:
-                break
-        obj = cloudpickle.loads(r.get('Traj'))
-
-        traj.copy(obj)
-        r.set('Traj_trigger' + "_{}".format(rank), '0')
+        _, obj = r.blpop('Traj_{}'.format(rank))
+        decode_traj(obj, traj)
 
     return traj
 
@@ -1,5 +1,8 @@
 import contextlib
 import copy
+import json
+import struct
+import threading
 
 import numpy as np
 import redis
@@ -15,6 +18,8 @@ except ImportError:
 from machina import logger
 
 _DEVICE = torch.device('cpu')
+# device overridden by cpu_mode in each thread
+_LOCAL = threading.local()
 
 _REDIS = None
 
@@ -33,6 +38,110 @@ def get_redis():
     return _REDIS
 
 
+# arrays in encoded bytes are aligned to this number of bytes
+_ALIGNMENT = 64
+
+
+def _compress(body, compression):
+    if compression == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress(body)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(body)
+    raise ValueError('compression should be None, lz4 or zstd')
+
+
+def _decompress(body, compression):
+    if compression == 'lz4':
+        import lz4.frame
+        return lz4.frame.decompress(body)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError('compression should be None, lz4 or zstd')
+
+
+def encode_arrays(arrays, meta=None, compression=None):
+    """
+    Encoding arrays to bytes of a header followed by raw buffers of arrays.
+    The header has keys, dtypes and shapes of arrays and meta in json.
+
+    Parameters
+    ----------
+    arrays : list of tuple of str or tuple and ndarray
+        Keys and arrays.
+    meta : dict or None
+        json serializable values which are stored in the header.
+    compression : str or None
+        None, 'lz4' (lz4 package) or 'zstd' (zstandard package).
+        Buffers are compressed as one block.
+
+    Returns
+    -------
+    data : bytes
+    """
+    entries = []
+    buffers = []
+    offset = 0
+    for key, array in arrays:
+        array = np.ascontiguousarray(array)
+        padding = -offset % _ALIGNMENT
+        buffers.append(bytes(padding))
+        offset += padding
+        entries.append(dict(key=key, dtype=array.dtype.str,
+                            shape=list(array.shape), offset=offset))
+        buffers.append(array.tobytes())
+        offset += array.nbytes
+    body = b''.join(buffers)
+    if compression is not None:
+        body = _compress(body, compression)
+    header = json.dumps(dict(entries=entries, meta=meta,
+                             compression=compression)).encode()
+    header += b' ' * (-(len(header) + 8) % _ALIGNMENT)
+    return struct.pack('<Q', len(header)) + header + body
+
+
+def decode_arrays(data, writable=False):
+    """
+    Inverse of encode_arrays.
+    Without compression, arrays are views of data.
+
+    Parameters
+    ----------
+    data : bytes
+    writable : bool
+        If True, arrays are writable, which needs one copy of data if data is bytes.
+
+    Returns
+    -------
+    arrays : list of tuple of str or tuple and ndarray
+        Keys in lists are converted to tuples.
+    meta : dict or None
+    """
+    header_length, = struct.unpack_from('<Q', data)
+    header = json.loads(bytes(memoryview(data)[8:8 + header_length]))
+    body = memoryview(data)[8 + header_length:]
+    if header['compression'] is not None:
+        body = _decompress(body, header['compression'])
+    if writable and (isinstance(body, bytes) or body.readonly):
+        body = bytearray(body)
+    arrays = []
+    for entry in header['entries']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        size = int(np.prod(shape))
+        if size == 0:
+            array = np.zeros(shape, dtype=dtype)
+        else:
+            array = np.frombuffer(body, dtype=dtype, count=size,
+                                  offset=entry['offset']).reshape(shape)
+        key = tuple(entry['key']) if isinstance(
+            entry['key'], list) else entry['key']
+        arrays.append((key, array))
+    return arrays, header['meta']
+
+
 def _int(v):
     try:
         new_v = int(v)
@@ -47,16 +156,21 @@ def set_device(device):
 
 
 def get_device():
+    device = getattr(_LOCAL, 'device', None)
+    if device is not None:
+        return device
     return _DEVICE
 
 
 @contextlib.contextmanager
 def cpu_mode():
-    global _DEVICE
-    tmp = _DEVICE
-    _DEVICE = torch.device('cpu')
-    yield
-    _DEVICE = tmp
+    # The override is thread local, so sampling threads do not change the device of training.
+    tmp = getattr(_LOCAL, 'device', None)
+    _LOCAL.device = torch.device('cpu')
+    try:
+        yield
+    finally:
+        _LOCAL.device = tmp
 
 
 @contextlib.contextmanager
@@ -1,19 +1,77 @@
+import multiprocessing as mp
 import os
 from signal import SIGTERM
 import subprocess
+import tempfile
+import time
 import unittest
 
+import cloudpickle
 import numpy as np
 import psutil
 import ray
+import torch
+import torch.nn as nn
 
 from machina.traj import Traj
 from machina.envs import GymEnv
-from machina.samplers import EpiSampler, DistributedEpiSampler
+from machina.samplers import CoreBudget, EpiSampler, DistributedEpiSampler, EvalSampler
 from machina.samplers.raysampler import EpiSampler as RaySampler
+from machina.samplers.distributed_epi_sampler import RESULT_KEY
+from machina.samplers.epi_sampler import batch_epis
+from machina.samplers.epi_buffer import SharedEpiBuffer, decode_epis, encode_epis, read_epis
+from machina.samplers.epi_dataset import EpiShardWriter, iterate_epis, load_traj, num_epis, shard_dirs
+from machina.samplers.rollout_buffer import RolloutBuffer
+from machina.samplers.shared_params import SharedParams, flatten_params, load_flat_params
+from machina.pols import GaussianPol
 from machina.pols.random_pol import RandomPol
+from machina.prepro import BasePrePro, RunningStats
+from machina.samplers.inference_pol import InferencePol
 from machina.utils import make_redis
 
+from simple_net import PolNet
+
+
+class FaultyEnv(object):
+    """
+    Env whose first step in all processes crashes or hangs.
+    """
+
+    def __init__(self, env, fault):
+        self.env = env
+        self.fault = fault
+        self.count = mp.Value('i', 0)
+
+    def reset(self):
+        return self.env.reset()
+
+    def step(self, ac):
+        with self.count.get_lock():
+            first = self.count.value == 0
+            self.count.value += 1
+        if first:
+            if self.fault == 'crash':
+                os._exit(1)
+            time.sleep(1000)
+        return self.env.step(ac)
+
+
+class LayeredRnnPol(RandomPol):
+    """
+    RandomPol which returns hidden states of a 2-layer rnn.
+    A hidden state is [layer * batch_size + index in batch].
+    """
+
+    def __init__(self, observation_space, action_space):
+        RandomPol.__init__(self, observation_space, action_space, rnn=True)
+
+    def forward(self, ob, h_masks=None):
+        ac_real, ac, a_i = RandomPol.forward(self, ob)
+        h = torch.arange(2 * ob.shape[0], dtype=torch.float).reshape(
+            2, ob.shape[0], 1)
+        a_i['hs'] = (h, h)
+        return ac_real, ac, a_i
+
 
 class TestTraj(unittest.TestCase):
 
@@ -30,6 +88,359 @@ class TestTraj(unittest.TestCase):
         epis = sampler.sample(self.pol, max_epis=2)
         assert len(epis) >= 2
 
+    def test_epi_sampler_envs_per_worker(self):
+        sampler = EpiSampler(self.env, self.pol,
+                             num_parallel=1, envs_per_worker=2)
+        epis = sampler.sample(self.pol, max_epis=3)
+        assert len(epis) >= 3
+        assert len(epis[0]['obs']) == len(epis[0]['acs'])
+
+    def test_batch_epis_multi_layer_rnn(self):
+        envs = [GymEnv('Pendulum-v0') for _ in range(2)]
+        pol = LayeredRnnPol(self.env.observation_space, self.env.action_space)
+        epis = [epi for _, epi in batch_epis(envs, pol)]
+        # Each env gets its hidden state of all layers.
+        assert set([tuple(epi['a_is']['hs'][0, 0]) for epi in epis]) == set([
+            (0., 2.), (1., 3.)])
+
+    def test_epi_sampler_async(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=1)
+        future = sampler.sample_async(self.pol, max_epis=2)
+        epis = future.result()
+        assert future.done()
+        obs = epis[0]['obs'].copy()
+        next_epis = sampler.sample_async(self.pol, max_epis=2).result()
+        assert len(next_epis) >= 2
+        np.testing.assert_array_equal(epis[0]['obs'], obs)
+
+    def test_epi_sampler_inference_server(self):
+        sampler = EpiSampler(self.env, self.pol,
+                             num_parallel=2, inference_server=True)
+        epis = sampler.sample(self.pol, max_epis=3)
+        assert len(epis) >= 3
+        assert epis[0]['acs'].shape == (
+            len(epis[0]['obs']), ) + self.env.action_space.shape
+
+    def test_epi_sampler_thread(self):
+        sampler = EpiSampler(self.env, self.pol,
+                             num_parallel=2, backend='thread')
+        epis = sampler.sample(self.pol, max_epis=3)
+        assert len(epis) >= 3
+        epis = sampler.sample_async(self.pol, max_steps=300).result()
+        assert sum([len(epi['rews']) for epi in epis]) >= 300
+
+    def test_epi_sampler_invalid_args(self):
+        with self.assertRaises(ValueError):
+            EpiSampler(self.env, self.pol, backend='unknown')
+        with self.assertRaises(ValueError):
+            EpiSampler(self.env, self.pol, backend='thread',
+                       inference_server=True)
+
+    def test_epi_sampler_stats(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=2)
+        epis = sampler.sample(self.pol, max_epis=3)
+        stats = sampler.stats(record=True, reset=True)
+        assert len(stats) == 2
+        assert sum([stat['epis'] for stat in stats]) == len(epis)
+        assert sum([stat['steps'] for stat in stats]) == sum(
+            [len(epi['rews']) for epi in epis])
+        assert all([stat['env_time'] <= stat['sample_time']
+                    for stat in stats])
+        assert sum([stat['steps'] for stat in sampler.stats()]) == 0
+
+    def test_epi_sampler_autotune(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=2, autotune=True,
+                             autotune_envs_per_worker=[1, 2], reserved_cpus=0)
+        autotuner = sampler.autotuner
+        for _ in range(len(autotuner.candidates) + 1):
+            epis = sampler.sample(self.pol, max_epis=2)
+            assert len(epis) >= 2
+        assert autotuner.finished
+        assert sampler.tuning is None
+        assert len(autotuner.history) == len(autotuner.candidates)
+        assert sampler.num_active == autotuner.result['num_workers']
+        assert sampler.envs_per_worker == autotuner.result['envs_per_worker']
+
+    def test_epi_sampler_pol_version(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=2)
+        for version in [1, 2]:
+            epis = sampler.sample(self.pol, max_epis=3)
+            assert all([epi['pol_version'] == version for epi in epis])
+        assert int(sampler.shared_params.version) == 2
+        traj = Traj()
+        traj.add_epis(epis)
+        traj.register_epis()
+
+    def test_shared_params(self):
+        module = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4))
+        shared_params = SharedParams(module)
+        new_module = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4))
+        new_module(torch.randn(8, 3))
+        shared_params.load(new_module)
+        assert int(shared_params.version) == 1
+        for t, new_t in zip(module.state_dict().values(), new_module.state_dict().values()):
+            assert torch.equal(t, new_t)
+        assert module[0].weight.data_ptr() == shared_params.flat.data_ptr()
+
+    def test_flatten_params(self):
+        module = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4))
+        new_module = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4))
+        new_module(torch.randn(8, 3))
+        flat, others = flatten_params(new_module)
+        assert len(others) == 1
+        load_flat_params(module, flat.half().float(), others)
+        for t, new_t in zip(module.state_dict().values(), new_module.state_dict().values()):
+            assert torch.allclose(t.float(), new_t.float(), atol=1e-2)
+
+    def test_epi_sampler_optimize_pol(self):
+        pol = GaussianPol(self.env.observation_space, self.env.action_space,
+                          PolNet(self.env.observation_space, self.env.action_space))
+        ob = torch.tensor(self.env.reset(), dtype=torch.float)
+        ac_real, ac, a_i = InferencePol(pol).deterministic_ac_real(ob)
+        np.testing.assert_allclose(
+            ac_real, pol.deterministic_ac_real(ob)[0], rtol=1e-5)
+        assert a_i['mean'].shape == ac.shape
+        for backend in ['process', 'thread']:
+            sampler = EpiSampler(self.env, pol, num_parallel=2,
+                                 backend=backend, optimize_pol=True)
+            epis = sampler.sample(pol, max_epis=2)
+            assert len(epis) >= 2
+            assert epis[0]['a_is']['mean'].shape == epis[0]['acs'].shape
+
+    def test_epi_sampler_dtypes(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=1,
+                             dtypes=dict(obs='float16', dones='uint8'))
+        epis = sampler.sample(self.pol, max_epis=2)
+        assert epis[0]['obs'].dtype == np.float16
+        assert epis[0]['dones'].dtype == np.uint8
+        assert epis[0]['rews'].dtype == np.float32
+        traj = Traj()
+        traj.add_epis(epis)
+        traj.register_epis()
+        assert traj.data_map['obs'].dtype == torch.float16
+        batch = next(traj.random_batch(8))
+        assert batch['obs'].dtype == torch.float
+        assert batch['dones'].dtype == torch.float
+
+    def test_epi_sampler_population(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=2)
+        pols = dict(a=self.pol, b=RandomPol(
+            self.env.observation_space, self.env.action_space))
+        population_epis = sampler.sample_population(
+            pols, max_epis=dict(a=2, b=3))
+        assert len(population_epis['a']) >= 2
+        assert len(population_epis['b']) >= 3
+        assert all([epi['pol_name'] == 'b' for epi in population_epis['b']])
+        obs = population_epis['a'][0]['obs'].copy()
+        sampler.sample(self.pol, max_epis=2)
+        sampler.sample(self.pol, max_epis=2)
+        np.testing.assert_array_equal(population_epis['a'][0]['obs'], obs)
+
+    def test_eval_sampler(self):
+        pol = GaussianPol(self.env.observation_space, self.env.action_space,
+                          PolNet(self.env.observation_space, self.env.action_space))
+        eval_sampler = EvalSampler(self.env, pol, num_epis=2)
+        for step in [100, 200]:
+            eval_sampler.evaluate(pol, step)
+        results = eval_sampler.wait()
+        eval_sampler.close()
+        assert [result['Step'] for result in results] == [100, 200]
+        assert all([result['EvalEpisode'] >= 2 for result in results])
+
+    def test_running_stats(self):
+        running_stats = RunningStats((3, ))
+        obs = np.random.randn(10, 3)
+        running_stats.update(obs[:4])
+        running_stats.update(obs[4:])
+        count, mean, var = running_stats.snapshot()
+        assert count == 10
+        np.testing.assert_allclose(mean, np.mean(obs, axis=0))
+        np.testing.assert_allclose(var, np.var(obs, axis=0))
+
+        for backend in ['process', 'thread']:
+            running_stats = RunningStats(self.env.observation_space.shape)
+            prepro = BasePrePro(self.env.observation_space,
+                                running_stats=running_stats, update_interval=1)
+            sampler = EpiSampler(self.env, self.pol, num_parallel=2,
+                                 prepro=prepro.prepro_with_update, backend=backend)
+            epis = sampler.sample(self.pol, max_epis=2)
+            assert running_stats.snapshot()[0] == sum(
+                [len(epi['obs']) for epi in epis])
+
+        # Prepro with RunningStats can be sent to other machines.
+        loaded = cloudpickle.loads(cloudpickle.dumps(prepro))
+        loaded.update_ob_rms(np.zeros(self.env.observation_space.shape))
+        assert loaded.running_stats.snapshot()[0] == running_stats.snapshot()[
+            0] + 1
+
+    def test_epi_sampler_stream(self):
+        for backend in ['process', 'thread']:
+            sampler = EpiSampler(self.env, self.pol,
+                                 num_parallel=2, backend=backend)
+            epis = []
+            for epi in sampler.stream(self.pol, max_epis=3):
+                epis.append(epi)
+                assert len(epi['obs']) == len(epi['rews'])
+            assert len(epis) >= 3
+            assert len(sampler.future.epis) == len(epis)
+            epis = sampler.sample(self.pol, max_epis=3)
+            assert len(epis) >= 3
+            future = sampler.sample_async(self.pol, max_epis=3, stream=True)
+            while not future.done():
+                time.sleep(0.01)
+            assert len(list(future.stream())) == len(future.result())
+
+    def test_core_budget(self):
+        cpus = sorted(os.sched_getaffinity(0))
+        core_budget = CoreBudget(learner_cpus=0)
+        assert core_budget.worker_cpus == cpus
+        assert core_budget.cpus_of_worker(len(cpus)) == cpus[:1]
+        sampler = EpiSampler(self.env, self.pol, num_parallel=2,
+                             core_budget=core_budget)
+        epis = sampler.sample(self.pol, max_epis=2)
+        assert len(epis) >= 2
+        for ind, p in enumerate(sampler.processes):
+            cpu_affinity = psutil.Process(p.pid).cpu_affinity()
+            assert cpu_affinity == core_budget.cpus_of_worker(ind)
+
+    def test_epi_sampler_crash(self):
+        sampler = EpiSampler(FaultyEnv(self.env, 'crash'),
+                             self.pol, num_parallel=2)
+        future = sampler.sample_async(self.pol, max_epis=2)
+        epis = future.result()
+        assert len(future.failed_workers) == 1
+        assert len(epis) >= 1
+        epis = sampler.sample(self.pol, max_epis=2)
+        assert len(epis) >= 2
+
+    def test_epi_sampler_timeout(self):
+        sampler = EpiSampler(FaultyEnv(self.env, 'hang'),
+                             self.pol, num_parallel=2)
+        future = sampler.sample_async(self.pol, max_epis=2)
+        epis = future.result(timeout=3)
+        assert len(future.failed_workers) == 1
+        assert len(epis) >= 1
+        epis = sampler.sample(self.pol, max_epis=2, timeout=60)
+        assert len(epis) >= 2
+
+    def test_epi_sampler_fragment(self):
+        sampler = EpiSampler(self.env, self.pol,
+                             num_parallel=2, fragment_length=64)
+        for _ in range(2):
+            epis = sampler.sample(self.pol, max_steps=300)
+            assert sum([len(epi['rews']) for epi in epis]) == 300
+            assert all([len(epi['rews']) <= 64 for epi in epis])
+            assert any([epi['truncated'] for epi in epis])
+            assert epis[0]['last_ob'].shape == self.env.observation_space.shape
+        traj = Traj()
+        traj.add_epis(epis)
+        traj.register_epis()
+        assert traj.num_step == 300
+
+    def test_shared_epi_buffer(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=1)
+        epis = sampler.sample(self.pol, max_epis=3)
+        epi_buffer = SharedEpiBuffer(capacity=1)
+        for epi in epis:
+            epi_buffer.add_epi(epi)
+        assert epi_buffer.capacity >= sum([len(epi['rews']) for epi in epis])
+        read = read_epis(epi_buffer.tensors(), epi_buffer.num_epi)
+        assert len(read) == len(epis)
+        np.testing.assert_array_equal(read[-1]['obs'], epis[-1]['obs'])
+        np.testing.assert_array_equal(
+            read[-1]['a_is']['mean'], epis[-1]['a_is']['mean'])
+
+    def test_epi_dataset(self):
+        for backend in ['process', 'thread']:
+            with tempfile.TemporaryDirectory() as record_dir:
+                sampler = EpiSampler(self.env, self.pol, num_parallel=2,
+                                     backend=backend, record_dir=record_dir)
+                epis = sampler.sample(self.pol, max_epis=3)
+                epis += sampler.sample(self.pol, max_epis=3)
+                del sampler
+                recorded = list(iterate_epis(record_dir))
+                assert len(recorded) == len(epis)
+                assert sum([len(epi['rews']) for epi in recorded]) == sum(
+                    [len(epi['rews']) for epi in epis])
+                traj = load_traj(record_dir)
+                assert traj.num_epi == len(epis)
+                assert traj.data_map['obs'].shape[0] == traj.num_step
+                assert num_epis(record_dir) == len(epis)
+                train_traj = load_traj(record_dir, end_epi=len(epis) - 1)
+                test_traj = load_traj(record_dir, start_epi=len(epis) - 1)
+                assert train_traj.num_epi == len(epis) - 1
+                assert test_traj.num_epi == 1
+                np.testing.assert_allclose(
+                    test_traj.data_map['obs'].numpy(), recorded[-1]['obs'], rtol=1e-6)
+
+    def test_epi_shard_writer(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=1)
+        epis = sampler.sample(self.pol, max_epis=3)
+        with tempfile.TemporaryDirectory() as record_dir:
+            shard_dir = os.path.join(record_dir, 'shard_0')
+            epi_writer = EpiShardWriter(shard_dir)
+            epi_writer.write(epis[0])
+            # Data of an unfinished episode is discarded when the shard is opened again.
+            epi_writer.files[0].write(b'0000')
+            epi_writer.close()
+            epi_writer = EpiShardWriter(shard_dir)
+            for epi in epis[1:]:
+                epi_writer.write(epi)
+            epi_writer.close()
+            recorded = list(iterate_epis(record_dir))
+            assert len(recorded) == len(epis)
+            np.testing.assert_array_equal(recorded[-1]['obs'], epis[-1]['obs'])
+            for i in [2, 10]:
+                epi_writer = EpiShardWriter(
+                    os.path.join(record_dir, 'shard_{}'.format(i)))
+                epi_writer.write(epis[i % len(epis)])
+                epi_writer.close()
+            assert [os.path.basename(shard_dir) for shard_dir in shard_dirs(record_dir)] == [
+                'shard_0', 'shard_2', 'shard_10']
+            np.testing.assert_array_equal(
+                recorded[-1]['a_is']['mean'], epis[-1]['a_is']['mean'])
+
+    def test_encode_epis(self):
+        sampler = EpiSampler(self.env, self.pol, num_parallel=1)
+        epis = sampler.sample(self.pol, max_epis=3)
+        for epi in epis:
+            epi['last_v'] = 1.5
+        decoded, meta = decode_epis(encode_epis(epis, dict(rank=1)))
+        assert meta['rank'] == 1
+        assert len(decoded) == len(epis)
+        np.testing.assert_array_equal(decoded[-1]['obs'], epis[-1]['obs'])
+        np.testing.assert_array_equal(
+            decoded[-1]['a_is']['mean'], epis[-1]['a_is']['mean'])
+        assert decoded[-1]['pol_version'] == epis[-1]['pol_version']
+        assert decoded[-1]['last_v'] == 1.5
+
+    def test_rollout_buffer(self):
+        rollout_buffer = RolloutBuffer((1, ), (1, ), capacity=1,
+                                       e_i_keys=['used'])
+        for _ in range(2):
+            rollout_buffer.reset()
+            for i in range(3):
+                rollout_buffer.add(np.zeros(3) + i, np.array([[i]]), 1., i == 2,
+                                   dict(mean=np.array([i]), hs=(
+                                       np.zeros((1, 4)), np.ones((1, 4))), log_std=None),
+                                   dict(used=i, unused='a'))
+        epi = rollout_buffer.epi()
+        assert rollout_buffer.capacity >= 3
+        np.testing.assert_array_equal(epi['obs'][:, 0], [0, 1, 2])
+        np.testing.assert_array_equal(epi['dones'], [0, 0, 1])
+        assert epi['a_is']['hs'].shape == (3, 2, 4)
+        assert set(epi['a_is'].keys()) == {'mean', 'hs'}
+        assert set(epi['e_is'].keys()) == {'used'}
+        copied_epi = rollout_buffer.epi(copy=True)
+        rollout_buffer.reset()
+        rollout_buffer.add(np.ones(3), np.array([[0]]), 0., True,
+                           dict(mean=np.array([0]), hs=(
+                               np.zeros((1, 4)), np.ones((1, 4)))),
+                           dict(used=0))
+        assert epi['obs'][0, 0] == 1
+        np.testing.assert_array_equal(copied_epi['obs'][:, 0], [0, 1, 2])
+        assert copied_epi['obs'].base is None
+
     def test_distributed_epi_sampler(self):
         proc_redis = subprocess.Popen(['redis-server'])
         proc_slave = subprocess.Popen(['python', '-m', 'machina.samplers.distributed_epi_sampler',
@@ -39,6 +450,14 @@ class TestTraj(unittest.TestCase):
             1, -1, self.env, self.pol, num_parallel=1)
         epis = sampler.sample(self.pol, max_epis=2)
         assert len(epis) >= 2
+        # A result which is left by a previous run is discarded.
+        sampler.r.rpush(RESULT_KEY, encode_epis(
+            [], dict(rank=0, iteration=-1, worker_stats=[])))
+        epis = sampler.sample(self.pol, max_epis=2, quorum=0.5, timeout=60)
+        assert len(epis) >= 1
+        node_stats = sampler.node_stats()
+        assert node_stats[0]['num_results'] == 2
+        assert node_stats[0]['max_latency'] > 0
         children = psutil.Process(os.getpid()).children(recursive=True)
         for child in children:
             child.send_signal(SIGTERM)
@@ -47,8 +466,10 @@ class TestTraj(unittest.TestCase):
         ray.init(num_cpus=1)
         sampler = RaySampler(self.env, self.pol, num_parallel=1)
         epis = sampler.sample(max_epis=2)
+        streamed_epis = list(sampler.stream(max_epis=2))
         ray.shutdown()
         assert len(epis) >= 2
+        assert len(streamed_epis) >= 2
 
 
 if __name__ == '__main__':
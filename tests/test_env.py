@@ -14,10 +14,11 @@ try:
 except:
     # gym 0.15.4 remove FlattendDictWrapper
     from gym.wrappers import FilterObservation, FlattenObservation
-from machina.envs import GymEnv, C2DEnv, flatten_to_dict
+from machina.envs import GymEnv, C2DEnv, SyntheticEnv, flatten_to_dict
 from simple_net import PolDictNet, VNet, QNet, VNetLSTM, PolNetDictLSTM, QNetLSTM
 from machina.vfuncs import DeterministicSVfunc, DeterministicSAVfunc
 from machina.pols import GaussianPol
+from machina.pols.random_pol import RandomPol
 from machina.traj import Traj
 from machina.traj import epi_functional as ef
 from machina.samplers import EpiSampler
@@ -47,6 +48,28 @@ def test_continuous2discrete():
     out = discrete_env.step([3, 10])
 
 
+def test_synthetic_env():
+    env = SyntheticEnv(ob_dim=4, ac_dim=2, epi_length=3, step_cost=1e-3)
+    ob = env.reset()
+    assert ob.shape == (4, )
+    ac = np.ones(2)
+    obs = []
+    done = False
+    while not done:
+        ob, rew, done, _ = env.step(ac)
+        obs.append(ob)
+    assert len(obs) == 3
+    assert rew == -2.
+    env.seed(0)
+    env.reset()
+    np.testing.assert_array_equal(env.step(ac)[0], obs[0])
+
+    pol = RandomPol(env.observation_space, env.action_space)
+    sampler = EpiSampler(env, pol, num_parallel=1)
+    epis = sampler.sample(pol, max_epis=2)
+    assert len(epis[0]['rews']) == 3
+
+
 def test_flatten2dict():
     dict_env = gym.make('PendulumDictEnv-v0')
     dict_env = GymEnv(dict_env)
@@ -3,6 +3,8 @@ import unittest
 import numpy as np
 
 from machina.traj import Traj
+from machina.traj import epi_functional as ef
+from machina.traj import traj_functional as tf
 from machina.envs import GymEnv
 from machina.samplers import EpiSampler
 from machina.pols.random_pol import RandomPol
@@ -30,6 +32,20 @@ class TestTraj(unittest.TestCase):
         assert new_traj.num_epi == self.traj.num_epi
         assert new_traj.num_step == self.traj.num_step
 
+    def test_compute_rets_truncated(self):
+        rews = np.array([1., 1.], dtype=np.float32)
+        epis = [dict(rews=rews), dict(rews=rews, truncated=True, last_v=10.)]
+        epis = ef.compute_rets(epis, 0.5)
+        np.testing.assert_allclose(epis[0]['rets'], [1.5, 1.])
+        np.testing.assert_allclose(epis[1]['rets'], [4., 6.])
+
+    def test_encode_traj(self):
+        new_traj = tf.decode_traj(tf.encode_traj(self.traj), Traj())
+        assert new_traj.num_epi == self.traj.num_epi
+        for key in self.traj.data_map:
+            np.testing.assert_array_equal(
+                new_traj.data_map[key].numpy(), self.traj.data_map[key].numpy())
+
     def test_random_batch_once(self):
         batch_size = 32
         data_map = self.traj.random_batch_once(